@@ -0,0 +1,384 @@
+"""
+run_bench.py - orchestration benchmark of VirtualPilot on simulated hosts
+
+virsh, virt-install, systemctl, the serial console and the L0 SSH endpoint
+are replaced by the simulators in bench/sim, with latencies, boot transcript
+and failure rates from a profile (bench/sim/simlib.py DEFAULT_PROFILE,
+overridden by --profile). Each scenario runs in its own process in a scratch
+workspace and reports suites per minute, orchestration overhead (wall time
+not spent in simulated operations) and peak memory. Results are kept in
+RESULTS_DIR (a temporary directory, or --results-dir) and compared with
+the previous result there.
+
+python3 bench/run_bench.py [--scenarios single,agent,multi,queue,nested,nested2] [--iterations 5] [--profile bench/profiles/flaky.json]
+python3 bench/run_bench.py --compare [old.json [new.json]] [--results-dir DIR]
+"""
+
+import argparse
+import glob
+import importlib.util
+import json
+import os
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import yaml
+
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SIM_DIR = os.path.join(REPO, "bench", "sim")
+RESULTS_DIR = os.path.join(tempfile.gettempdir(), "virtualpilot-bench")
+# Repo entries linked into the workspace, so suites use repo-relative paths as from the repo root
+LINKED = ["virtual-pilot.py", "virtual-pilot-avocado.py", "virtual-pilot-worker.py", "virtual-pilot-coordinator.py",
+          "orchestrator.py", "src", "utils"]
+IMAGE = "guests/qcows/sim.qcow2"
+# Guests of each nesting level, L0 first
+LEVEL_NAMES = ["vp-sim-l0", "vp-sim-l1"]
+
+sys.path.insert(0, SIM_DIR)
+import simlib
+
+
+def setup_workspace(ws, image_mb):
+    for entry in LINKED:
+        os.symlink(os.path.join(REPO, entry), os.path.join(ws, entry))
+    os.makedirs(os.path.join(ws, "guests", "qcows"))
+    with open(os.path.join(ws, IMAGE), "wb") as f:
+        f.write(b"\0" * image_mb * 2**20)
+    os.makedirs(os.path.join(ws, "config"))
+
+
+def write_suite(ws, suite):
+    path = os.path.join("config", f"{suite['name']}.yaml")
+    with open(os.path.join(ws, path), "w") as f:
+        yaml.safe_dump(suite, f, sort_keys=False)
+    return path
+
+
+def guest_params(profile, name):
+    latency = profile["latency"]
+    return {
+        "name": name,
+        "accelerator": "kvm",
+        "qcow_path": IMAGE,
+        "boot_timeout": int(latency["boot"] * 3 + 10),
+        "virt_install_timeout": int(latency["virt_install"] * 3 + 5),
+        "check_guest_config": False,
+        "report_boot_phases": False,
+    }
+
+
+def bringup_suite(profile, i, login_method="console"):
+    params = guest_params(profile, f"vp-sim-{i}")
+    params["login_method"] = login_method
+    return {"name": f"sim_bringup_{i}", "nested": False, "script": "src/guest_bringup", "params": params}
+
+
+def bringdown_suite(i):
+    return {"name": f"sim_bringdown_{i}", "nested": False, "script": "src/guest_bringdown",
+            "params": {"name": f"vp-sim-{i}"}}
+
+
+def run_single(ws, iterations, profile, login_method="console"):
+    """
+    run_suite_from_config on a bringup and a bringdown suite per iteration,
+    logging in on the console or waiting for the guest agent
+    """
+    from orchestrator import run_suite_from_config
+    results = []
+    for i in range(iterations):
+        for suite in (bringup_suite(profile, i, login_method), bringdown_suite(i)):
+            path = write_suite(ws, suite)
+            status, error = run_suite_from_config(path)
+            results.append({"suite": path, "status": status, "error": error})
+    return results, "run_suite_from_config"
+
+
+def run_multi(ws, iterations, profile):
+    """
+    Multi-suite run of all bringup/bringdown pairs from one suites_to_run
+    file, through avocado when installed, else the way the generated
+    avocado tests run each suite
+    """
+    suites = []
+    for i in range(iterations):
+        suites.append(write_suite(ws, bringup_suite(profile, i)))
+        suites.append(write_suite(ws, bringdown_suite(i)))
+    list_path = os.path.join("config", "sim_suites.yaml")
+    with open(list_path, "w") as f:
+        yaml.safe_dump({"suites_to_run": suites}, f)
+
+    spec = importlib.util.spec_from_file_location("virtual_pilot_avocado", os.path.join(REPO, "virtual-pilot-avocado.py"))
+    generator = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(generator)
+    suite_file, _ = generator.generate_avocado_suite_file(list_path, "avocado_main.py")
+
+    if importlib.util.find_spec("avocado") is not None:
+        returncode = generator.run_avocado_suites(suite_file, "./results/avocado")
+        return [{"suite": list_path, "status": returncode == 0, "error": None if returncode == 0 else f"avocado exit {returncode}"}] \
+            * len(suites), "avocado"
+
+    from orchestrator import run_suite_from_config
+    from utils import checkpoint
+    ckpt = generator.suites_checkpoint_path(list_path)
+    results = []
+    for path in suites:
+        status, error = run_suite_from_config(path)
+        if status:
+            checkpoint.mark_step(ckpt, path)
+        results.append({"suite": path, "status": status, "error": error})
+    return results, "inline"
+
+
+def run_queue(ws, iterations, profile, workers=2):
+    """
+    The bringup/bringdown pairs dispatched by the coordinator to worker
+    daemons sharing a queue directory. Workers are stopped with SIGTERM
+    and have to exit on their own.
+    """
+    suites = []
+    for i in range(iterations):
+        suites.append(write_suite(ws, bringup_suite(profile, i)))
+        suites.append(write_suite(ws, bringdown_suite(i)))
+    list_path = os.path.join("config", "sim_suites.yaml")
+    with open(list_path, "w") as f:
+        yaml.safe_dump({"suites_to_run": suites}, f)
+
+    spec = importlib.util.spec_from_file_location("virtual_pilot_coordinator",
+                                                  os.path.join(REPO, "virtual-pilot-coordinator.py"))
+    coordinator_module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(coordinator_module)
+
+    queue = os.path.join("results", "queue")
+    processes = [subprocess.Popen([sys.executable, "virtual-pilot-worker.py", "--queue", queue, "--id", f"sim-w{i}",
+                                   "--memory-mb", "65536", "--vcpus", "64", "--accelerators", "kvm,tcg"],
+                                  stdout=subprocess.DEVNULL)
+                 for i in range(workers)]
+    try:
+        _, jobs = coordinator_module.load_jobs(list_path, queue, False, True)
+        coordinator = coordinator_module.Coordinator(queue, jobs, dispatch_timeout=60, follow=False)
+        coordinator.run()
+    finally:
+        for process in processes:
+            process.terminate()
+    results = [{"suite": job["suite"], "status": coordinator.results[job["id"]]["status"] == "pass",
+                "error": coordinator.results[job["id"]].get("error")} for job in jobs]
+    for i, process in enumerate(processes):
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            results.append({"suite": f"worker sim-w{i}", "status": False, "error": "worker did not stop on SIGTERM"})
+    return results, "coordinator"
+
+
+def run_nested(ws, iterations, profile, depth=1):
+    """
+    run_suite_on_L0 flow per iteration - push artifacts to the simulated L0,
+    run the bringup suite there, pull the console logs back. With depth 2
+    the run on L0 repeats it against L1, each level in its own directory.
+    """
+    from orchestrator import run_suite_from_config
+
+    # The guests of each level are up with their guest agent answering
+    booted = time.time() - profile["latency"]["agent_ready"] - 1
+    for name in LEVEL_NAMES[:depth]:
+        simlib.set_domain_state(name, "running")
+        os.utime(simlib.domain_path(name), (booted, booted))
+    # Runs on the simulated levels import the SSH stand-ins too
+    os.environ["PYTHONPATH"] = os.path.join(SIM_DIR, "ssh")
+
+    results = []
+    for i in range(iterations):
+        params = guest_params(profile, f"vp-sim-nested-{i}")
+        params.update({
+            "qcow_path": os.path.basename(IMAGE),
+            "nested_levels": [{"l0_name": name, "l0_location": os.path.join(ws, f"l{level}", "")}
+                              for level, name in enumerate(LEVEL_NAMES[:depth])],
+            "host_virtualpilot": "virtual-pilot.py",
+            "host_orchestrator": "orchestrator.py",
+            "host_script": "src/guest_bringup.py",
+            "host_suite": os.path.join("config", f"sim_nested_bringup_{i}.yaml"),
+            "nested_guest_image": IMAGE,
+        })
+        path = write_suite(ws, {"name": f"sim_nested_bringup_{i}", "nested": depth if depth > 1 else True,
+                                "script": "guest_bringup", "params": params})
+        status, error = run_suite_from_config(path)
+        results.append({"suite": path, "status": status, "error": error})
+    return results, "run_suite_on_L0"
+
+
+SCENARIOS = {
+    "single": run_single,
+    "agent": lambda ws, iterations, profile: run_single(ws, iterations, profile, login_method="agent"),
+    "multi": run_multi,
+    "queue": run_queue,
+    "nested": run_nested,
+    "nested2": lambda ws, iterations, profile: run_nested(ws, iterations, profile, depth=2),
+}
+
+
+def step_means(db_path):
+    """
+    Mean duration of each recorded run_tool step
+    """
+    if not os.path.exists(db_path):
+        return {}
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute("SELECT step, AVG(duration) FROM steps GROUP BY step ORDER BY step").fetchall()
+    finally:
+        conn.close()
+    return {step: round(mean, 3) for step, mean in rows}
+
+
+def run_scenario(name, iterations, profile_path, image_mb, out):
+    """
+    Run one scenario in a scratch workspace, in this process, and write its metrics to out
+    """
+    ws = tempfile.mkdtemp(prefix=f"vp-bench-{name}-")
+    setup_workspace(ws, image_mb)
+    state = os.path.join(ws, "sim")
+    os.environ["PATH"] = os.path.join(SIM_DIR, "bin") + os.pathsep + os.environ["PATH"]
+    os.environ[simlib.STATE_ENV] = state
+    if profile_path:
+        os.environ[simlib.PROFILE_ENV] = os.path.abspath(profile_path)
+    sys.path.insert(0, os.path.join(SIM_DIR, "ssh"))
+    sys.path.insert(0, REPO)
+    os.chdir(ws)
+    profile = simlib.load_profile()
+
+    start = time.monotonic()
+    results, runner = SCENARIOS[name](ws, iterations, profile)
+    wall = time.monotonic() - start
+
+    simulated = simlib.ledger_seconds(state)
+    passed = sum(1 for r in results if r["status"])
+    errors = {}
+    for r in results:
+        if r["error"]:
+            first_line = str(r["error"]).splitlines()[0]
+            errors[first_line] = errors.get(first_line, 0) + 1
+    metrics = {
+        "runner": runner,
+        "suites": len(results),
+        "passed": passed,
+        "failed": len(results) - passed,
+        "errors": errors,
+        "wall_s": round(wall, 3),
+        "simulated_s": round(simulated, 3),
+        "suites_per_min": round(60 * len(results) / wall, 2),
+        "overhead_s_per_suite": round((wall - simulated) / len(results), 3),
+        "overhead_pct": round(100 * (wall - simulated) / wall, 1),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "children_peak_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+        "steps": step_means(os.path.join(ws, "results", "history.db")),
+        "workspace": ws,
+    }
+    with open(out, "w") as f:
+        json.dump(metrics, f)
+
+
+def git_commit():
+    result = subprocess.run(["git", "-C", REPO, "describe", "--always", "--dirty"], capture_output=True, text=True)
+    return result.stdout.strip() or "unknown"
+
+
+def latest_results(results_dir, count):
+    return sorted(glob.glob(os.path.join(results_dir, "bench_*.json")), key=os.path.getmtime)[-count:]
+
+
+COMPARED = ["suites_per_min", "overhead_s_per_suite", "peak_rss_mb", "children_peak_rss_mb"]
+
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"\nCompare {old['commit']} ({os.path.basename(old_path)}) -> {new['commit']} ({os.path.basename(new_path)})")
+    if old["profile"] != new["profile"] or old["iterations"] != new["iterations"]:
+        print("Warning: results were taken with different profiles or iterations")
+    print(f"{'scenario':<10}  {'metric':<22}  {'old':>10}  {'new':>10}  {'change':>8}")
+    for scenario, metrics in new["scenarios"].items():
+        if scenario not in old["scenarios"]:
+            continue
+        for metric in COMPARED:
+            a, b = old["scenarios"][scenario][metric], metrics[metric]
+            change = f"{100 * (b - a) / a:+.1f}%" if a else "n/a"
+            print(f"{scenario:<10}  {metric:<22}  {a:>10}  {b:>10}  {change:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="VirtualPilot orchestration benchmark on simulated hosts")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"Comma separated, of: {', '.join(SCENARIOS)}")
+    parser.add_argument("--iterations", type=int, default=5, help="Bringups per scenario (default: 5)")
+    parser.add_argument("--profile", help="Simulator profile JSON overriding latencies and failure rates")
+    parser.add_argument("--image-mb", type=int, default=16, help="Size of the simulated guest image (default: 16)")
+    parser.add_argument("--compare", nargs="*", metavar="RESULT", help="Compare two results (default: the last two)")
+    parser.add_argument("--results-dir", default=RESULTS_DIR, help=f"Where results are kept (default: {RESULTS_DIR})")
+    parser.add_argument("--run-scenario", help=argparse.SUPPRESS)
+    parser.add_argument("--out", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_scenario:
+        run_scenario(args.run_scenario, args.iterations, args.profile, args.image_mb, args.out)
+        return
+
+    if args.compare is not None:
+        paths = args.compare + latest_results(args.results_dir, 2 - len(args.compare)) if len(args.compare) < 2 else args.compare
+        if len(paths) < 2:
+            print(f"Need two results to compare, found {len(paths)} in {args.results_dir}")
+            sys.exit(1)
+        compare(paths[0], paths[1])
+        return
+
+    previous = latest_results(args.results_dir, 1)
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(),
+        "iterations": args.iterations,
+        "profile": simlib.load_profile(args.profile),
+        "scenarios": {},
+    }
+    for name in args.scenarios.split(","):
+        if name not in SCENARIOS:
+            print(f"Unknown scenario: {name}, known: {', '.join(SCENARIOS)}")
+            sys.exit(1)
+        print(f"Bench | {name}: {args.iterations} iterations ...", flush=True)
+        with tempfile.NamedTemporaryFile(suffix=".json") as out, \
+                tempfile.NamedTemporaryFile("w", prefix=f"vp-bench-{name}-", suffix=".log", delete=False) as log:
+            cmd = [sys.executable, os.path.abspath(__file__), "--run-scenario", name, "--out", out.name,
+                   "--iterations", str(args.iterations), "--image-mb", str(args.image_mb)]
+            if args.profile:
+                cmd.extend(["--profile", os.path.abspath(args.profile)])
+            returncode = subprocess.run(cmd, stdout=log, stderr=subprocess.STDOUT).returncode
+            if returncode != 0:
+                print(f"Bench | {name} crashed with exit code {returncode}, output in {log.name}")
+                sys.exit(1)
+            metrics = json.load(out)
+        metrics["log"] = log.name
+        report["scenarios"][name] = metrics
+        print(f"Bench | {name} ({metrics['runner']}): {metrics['passed']}/{metrics['suites']} passed, "
+              f"{metrics['suites_per_min']} suites/min, overhead {metrics['overhead_s_per_suite']}s/suite "
+              f"({metrics['overhead_pct']}%), peak RSS {metrics['peak_rss_mb']} MB "
+              f"(children {metrics['children_peak_rss_mb']} MB)")
+        for error, count in metrics["errors"].items():
+            print(f"Bench |   {count}x {error}")
+
+    os.makedirs(args.results_dir, exist_ok=True)
+    path = os.path.join(args.results_dir, f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{report['commit']}.json")
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Bench | results saved to {path}")
+    if previous:
+        compare(previous[0], path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+simlib.py - shared state of the simulated virsh, virt-install, systemctl
+and SSH endpoint used by bench/run_bench.py
+
+The simulators read their profile (latencies, boot transcript, failure
+rates) from the JSON file in $VP_SIM_PROFILE and keep domain states and a
+ledger of simulated seconds under $VP_SIM_STATE.
+"""
+
+import json
+import os
+import random
+import time
+
+
+SIM_DIR = os.path.dirname(os.path.abspath(__file__))
+PROFILE_ENV = "VP_SIM_PROFILE"
+STATE_ENV = "VP_SIM_STATE"
+
+# Seconds per simulated operation, failure rates between 0 and 1
+DEFAULT_PROFILE = {
+    "latency": {
+        "virsh": 0.02,
+        "virt_install": 0.5,
+        "domain_start": 0.3,
+        "libvirtd_restart": 0.2,
+        "boot": 2.0,
+        "agent_ready": 1.0,
+        "ssh_connect": 0.05,
+        "ssh_exec": 0.02,
+        "scp_mb_s": 500,
+    },
+    "transcript": os.path.join(SIM_DIR, "boot_transcript.txt"),
+    "failures": {
+        "virt_install": 0.0,
+        "boot_hang": 0.0,
+        "call_trace": 0.0,
+        "ssh": 0.0,
+    },
+    "seed": 0,
+}
+
+
+def load_profile(path=None):
+    """
+    DEFAULT_PROFILE overlaid with the profile JSON file, one level deep
+    """
+    profile = json.loads(json.dumps(DEFAULT_PROFILE))
+    path = path or os.environ.get(PROFILE_ENV)
+    if path:
+        with open(path) as f:
+            for key, value in json.load(f).items():
+                if isinstance(value, dict):
+                    profile[key].update(value)
+                else:
+                    profile[key] = value
+    return profile
+
+
+def state_dir():
+    path = os.environ.get(STATE_ENV, "/tmp/virtualpilot-sim")
+    os.makedirs(os.path.join(path, "domains"), exist_ok=True)
+    return path
+
+
+def simulate(kind, seconds):
+    """
+    Sleep for a simulated operation and add it to the ledger, so the
+    harness can tell simulated time from orchestration overhead
+    """
+    if seconds <= 0:
+        return
+    time.sleep(seconds)
+    with open(os.path.join(state_dir(), "ledger"), "a") as f:
+        f.write(f"{kind} {seconds:.6f}\n")
+
+
+def ledger_seconds(path):
+    """
+    Simulated seconds recorded in a state dir
+    """
+    ledger = os.path.join(path, "ledger")
+    if not os.path.exists(ledger):
+        return 0.0
+    with open(ledger) as f:
+        return sum(float(line.split()[1]) for line in f if line.strip())
+
+
+def inject(profile, failure):
+    """
+    Whether to inject failure on this call. Draws are seeded by the profile
+    seed and a per-failure call counter, so a profile fails the same calls
+    on every bench run.
+    """
+    rate = profile["failures"].get(failure, 0.0)
+    if rate <= 0:
+        return False
+    counter = os.path.join(state_dir(), f"calls_{failure}")
+    calls = 0
+    if os.path.exists(counter):
+        with open(counter) as f:
+            calls = int(f.read() or 0)
+    with open(counter, "w") as f:
+        f.write(str(calls + 1))
+    return random.Random(f"{profile['seed']}:{failure}:{calls}").random() < rate
+
+
+def domain_path(name):
+    return os.path.join(state_dir(), "domains", name)
+
+
+def domain_state(name):
+    """
+    "running", "shut off", or None when the domain is not defined
+    """
+    path = domain_path(name)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return f.read().strip()
+
+
+def set_domain_state(name, state):
+    if state is None:
+        if os.path.exists(domain_path(name)):
+            os.remove(domain_path(name))
+        return
+    with open(domain_path(name), "w") as f:
+        f.write(state)
+
+
+def running_for(name):
+    """
+    Seconds since the domain was started
+    """
+    return time.time() - os.path.getmtime(domain_path(name))
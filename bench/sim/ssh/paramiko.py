@@ -0,0 +1,64 @@
+"""
+Simulated paramiko for bench/run_bench.py - the "remote" L0 commands run
+in a local shell after the ssh_exec latency, the SSH connection takes the
+ssh_connect latency and fails at the ssh failure rate
+"""
+
+import io
+import os
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import simlib
+
+
+class SSHException(Exception):
+    pass
+
+
+class AutoAddPolicy:
+    pass
+
+
+class Channel:
+    def __init__(self, exit_status):
+        self.exit_status = exit_status
+
+    def recv_exit_status(self):
+        return self.exit_status
+
+
+class ChannelFile(io.BytesIO):
+    def __init__(self, data, channel):
+        super().__init__(data)
+        self.channel = channel
+
+
+class SSHClient:
+    def __init__(self):
+        self.profile = simlib.load_profile()
+        self.connected = False
+
+    def set_missing_host_key_policy(self, policy):
+        pass
+
+    def connect(self, hostname, username=None, password=None, **kwargs):
+        simlib.simulate("ssh_connect", self.profile["latency"]["ssh_connect"])
+        if simlib.inject(self.profile, "ssh"):
+            raise SSHException(f"Error reading SSH protocol banner from {hostname} (simulated)")
+        self.connected = True
+
+    def exec_command(self, command):
+        if not self.connected:
+            raise SSHException("SSH session not active")
+        simlib.simulate("ssh_exec", self.profile["latency"]["ssh_exec"])
+        result = subprocess.run(["bash", "-c", command], capture_output=True)
+        channel = Channel(result.returncode)
+        return ChannelFile(b"", channel), ChannelFile(result.stdout, channel), ChannelFile(result.stderr, channel)
+
+    def get_transport(self):
+        return self
+
+    def close(self):
+        self.connected = False
@@ -0,0 +1,30 @@
+"""
+Simulated scp for bench/run_bench.py - local copies taking the time of a
+transfer at scp_mb_s
+"""
+
+import os
+import shutil
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import simlib
+
+
+class SCPClient:
+    def __init__(self, transport):
+        self.transport = transport
+        self.profile = simlib.load_profile()
+
+    def _copy(self, src, dest, preserve_times=False):
+        simlib.simulate("scp", os.path.getsize(src) / 2**20 / self.profile["latency"]["scp_mb_s"])
+        (shutil.copy2 if preserve_times else shutil.copy)(src, dest)
+
+    def put(self, files, remote_path, recursive=False, preserve_times=False):
+        self._copy(files, remote_path, preserve_times)
+
+    def get(self, remote_path, local_path):
+        self._copy(remote_path, local_path)
+
+    def close(self):
+        pass
@@ -1,26 +1,74 @@
 import yaml
 import importlib.util
+import json
 import os
+import time
+from utils import result_cache
+from utils import run_history
+from utils import log_archive
+from utils import telemetry
+from datetime import datetime
 
-def run_suite_from_config(yaml_path: str) -> bool:
+# Printed after each run, nested runs pass step timings up to the level above
+STEP_TIMING_MARKER = "Orchestrate | step timing: "
+
+
+def nesting_depth(cfg):
+    """
+    Guest levels between the host and the suite - "nested: true" is one
+    level (run on L0), "nested: 2" runs the suite inside a guest of L0
+    """
+    nested = cfg.get("nested")
+    if nested is True:
+        return 1
+    if isinstance(nested, int) and not isinstance(nested, bool):
+        return max(nested, 0)
+    return 0
+
+
+def run_suite_from_config(yaml_path: str, resume: bool = False, use_cache: bool = True) -> bool:
     """
     loads YAML, imports script module, and calls run_tool(config)
+    resume: continue from the last checkpointed step of a previous run
+    use_cache: report suites with "cache: true" as cached-pass when their
+               inputs match a pass younger than "cache_ttl" seconds
     """
 
     with open(yaml_path) as f:
         cfg = yaml.safe_load(f)
     params = cfg.get("params", {})
     script_name = cfg.get("script")
+    if resume:
+        params["resume"] = True
+    if not use_cache:
+        params["no_cache"] = True
+
+    # Skip the suite if an identical one passed recently
+    cache_key = None
+    if cfg.get("cache") == True and use_cache and not resume:
+        if nesting_depth(cfg) > 0:
+            print("Cache | nested suite is cached on L0, where its QEMU/libvirt versions are known")
+        else:
+            cache_key = result_cache.cache_key(cfg)
+            entry = result_cache.lookup(cache_key, cfg.get("cache_ttl", result_cache.DEFAULT_TTL))
+            if entry:
+                result_cache.record_hit(yaml_path, entry)
+                run_history.record_run(yaml_path, cfg, time.time(), 0.0, "cached", None)
+                # Nothing was booted, the bringdown of the pair has no guest to remove
+                if os.path.basename(str(script_name)) == "guest_bringup" and params.get("name"):
+                    result_cache.mark_absent(params["name"])
+                print(f"Orchestrate | cached-pass {yaml_path}, saved {entry['duration']:.1f}s of wall time")
+                return True, None
 
     orchestrator_dir = os.path.dirname(os.path.abspath(__file__))
 
     # If nested, use run_suite_on_L0.py
-    if cfg.get("nested") == True:
+    if nesting_depth(cfg) > 0:
         script_path = os.path.join(orchestrator_dir, "utils", "run_suite_on_L0.py")
         spec = importlib.util.spec_from_file_location("run_suite_on_L0", script_path)
         module = importlib.util.module_from_spec(spec)
         spec.loader.exec_module(module)
-        print(f"Orchestrate | running nested {script_name} on l0 with params: {params}")
+        print(f"Orchestrate | running nested {script_name} {nesting_depth(cfg)} level(s) down with params: {params}")
 
     # Else, import the script directly
     else:
@@ -30,6 +78,44 @@ def run_suite_from_config(yaml_path: str) -> bool:
         spec.loader.exec_module(module)
         print(f"Orchestrate | running {script_name} with params: {params}")
 
-    # Call run_tool from the imported module
-    status, error = module.run_tool(params)
+    # Call run_tool from the imported module, it fills run_info with step durations
+    run_info = run_history.new_run_info(run_history.config_digest(cfg))
+    params["run_info"] = run_info
+
+    # Sample host and domain stats for the lifetime of run_tool
+    sampler = None
+    if cfg.get("telemetry") == True:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        suite_name = os.path.splitext(os.path.basename(yaml_path))[0]
+        sampler = telemetry.start(
+            os.path.join(telemetry.TELEMETRY_DIR, f"telemetry_{suite_name}_{timestamp}.jsonl.gz"),
+            [params.get("name"), params.get("l0_name")],
+            cfg.get("telemetry_interval", telemetry.DEFAULT_INTERVAL)
+        )
+
+    started_at = time.time()
+    start = time.monotonic()
+    try:
+        status, error = module.run_tool(params)
+    finally:
+        if sampler is not None:
+            run_info["attachments"]["telemetry"] = telemetry.stop(sampler)
+    duration = time.monotonic() - start
+    print(f"{STEP_TIMING_MARKER}{json.dumps(run_info['steps'])}")
+    if status and cache_key:
+        result_cache.record_pass(cache_key, yaml_path, duration)
+
+    # Move the finished console log into the archive, failed runs included
+    # so their error signatures are indexed. Logs of failed runs kept for
+    # --resume (checkpoint: true or a resumed run) stay in place.
+    resumable = not status and (params.get("checkpoint") == True or resume)
+    if not resumable and cfg.get("archive_logs") == True and run_info["log_path"]:
+        archived, result = log_archive.ingest(run_info["log_path"])
+        if archived:
+            run_info["log_path"] = result
+        else:
+            print(f"Archive | {result}")
+
+    # Append the run to the history store
+    run_history.record_run(yaml_path, cfg, started_at, duration, "pass" if status else "fail", error, run_info)
     return status, error
@@ -1,12 +1,16 @@
 import subprocess
 import time
 import logging
+from utils import run_history
+from utils import placement
+from utils import result_cache
 
 
 DEFAULTS = {
     "name": "fedora43-virtualpilot-kvm-pseries",
     "accelerator": "kvm",
-    "enable_disable_kvm": False
+    "enable_disable_kvm": False,
+    "run_info": None
 }
 
 
@@ -141,6 +145,8 @@ def run_tool(config: dict):
     1. Shutdown guest (optional)
     2. Destroy guest
     3. Undefine guest              
+    Passes without doing anything when the bringup of the guest was a
+    cached pass, which never defined it.
     """
     status = True
     error = None
@@ -149,21 +155,31 @@ def run_tool(config: dict):
     cfg = DEFAULTS.copy()
     cfg.update({k: v for k, v in config.items() if v is not None})
 
-    destroy_status, destroy_result = virsh_destroy(cfg)
+    if result_cache.take_absent(cfg["name"]):
+        print(f"Bringdown: {cfg['name']} was not defined, its bringup was a cached pass")
+        return status, error
+
+    with run_history.step(cfg["run_info"], "destroy"):
+        destroy_status, destroy_result = virsh_destroy(cfg)
     if not destroy_status:
         error = f"Destroy failed: {destroy_result}"
         status = False
 
-    undefine_status, undefine_result = virsh_undefine(cfg)
+    with run_history.step(cfg["run_info"], "undefine"):
+        undefine_status, undefine_result = virsh_undefine(cfg)
     if not undefine_status:
         if status is False:
             error += f" | Undefine failed: {undefine_result}"
         else:
             error = f"Undefine failed: {undefine_result}"
         status = False
+    else:
+        # Free the host CPUs reserved by vcpu_pinning: auto
+        placement.release(cfg["name"])
 
     if cfg["enable_disable_kvm"] == True:
-        disble_kvm_status, disable_kvm_error = restore_kvm(cfg)
+        with run_history.step(cfg["run_info"], "restore_kvm"):
+            disble_kvm_status, disable_kvm_error = restore_kvm(cfg)
         if not disble_kvm_status:
             if status is False:
                 error += f" | Restore KVM failed: {disable_kvm_error}"
@@ -1,8 +1,20 @@
 import subprocess
 import time
+import os
 import pexpect
 import logging
 from datetime import datetime
+from utils import checkpoint
+from utils import run_history
+from utils import adaptive_timeouts
+from utils import log_archive
+from utils import guest_probe
+from utils import guest_benchmark
+from utils import placement
+from utils import image_prep
+from utils import guest_agent
+from utils import console_mux
+from utils import result_cache
 
 
 DEFAULTS = {
@@ -25,9 +37,40 @@ DEFAULTS = {
     'login_prompt': '\\w+ login: ',
     'password_prompt': '[Pp]assword: ',
     'shell_prompt': '.*[#$] ',
+    'login_method': 'console',
     'boot_timeout': 40,
     'virt_install_timeout': 10,
-    'disable_kvm': False
+    'vcpu_pinning': None,
+    'emulator_pinning': None,
+    'numa_nodeset': None,
+    'numa_mode': 'strict',
+    'hugepages': False,
+    'hugepage_size_kb': None,
+    'iothreads': 0,
+    'disk_bus': 'scsi',
+    'disk_cache': None,
+    'disk_io': None,
+    'disk_discard': None,
+    'disk_iothread': None,
+    'disk_queues': None,
+    'disable_kvm': False,
+    'warm_image': False,
+    # true fails the bringup on a mismatch, warn only reports it
+    'check_guest_config': False,
+    'probe_timeout': 60,
+    'memory_tolerance': 0.15,
+    'benchmarks': [],
+    'report_boot_phases': False,
+    'adaptive_timeouts': False,
+    'adaptive_percentile': 95,
+    'adaptive_margin': 0.25,
+    'adaptive_min_runs': 5,
+    'adaptive_load_factor': True,
+    'resume': False,
+    # Keep the checkpoint of a failed run for --resume
+    'checkpoint': False,
+    'run_info': None,
+    'checkpoint_dir': checkpoint.CHECKPOINT_DIR
 }
 
 
@@ -116,33 +159,57 @@ def disable_kvm(cfg):
         return False, f"Error disabling KVM: {str(e)}"
 
 
+def domain_is_running(cfg):
+    """
+    Check if guest is already running - virsh domstate <vm>
+    """
+    result = subprocess.run(
+        ["virsh", "domstate", cfg['name']],
+        capture_output=True,
+        text=True
+    )
+    return result.returncode == 0 and result.stdout.strip() == "running"
+
+
 def console_login(cfg, log_file):
     """
     Get into guest console via - virsh start <vm> --console
+    On resume against an already running guest - virsh console <vm>
+    The console is attached through the domain console multiplexer, which
+    copies it into the console log.
+    Returns the logged-in console session on success
     """
 
-    console_cmd = f"virsh start {cfg['name']} --console"
+    attach = cfg['resume'] and domain_is_running(cfg)
+    if attach:
+        console_cmd = f"virsh console {cfg['name']} --force"
+    else:
+        console_cmd = f"virsh start {cfg['name']} --console"
 
     try:
         print(f"Starting console with: {console_cmd}")
 
-        # Start virsh console with pexpect
-        child = pexpect.spawn(console_cmd, timeout=cfg['boot_timeout'])
-        child.expect(cfg['login_prompt'])
-        stdout = child.before.decode('utf-8')
+        # Attach the console once, log in over a session of it
+        status, result = console_mux.attach(cfg['name'], console_cmd, log_file, running=attach)
+        if not status:
+            return False, result
+        child = result.session(timeout=cfg['boot_timeout'], backlog=True)
+        if attach:
+            # Running guest won't reprint its prompt until poked
+            child.sendline("")
+            if child.expect([cfg['login_prompt'], cfg['shell_prompt']]) == 1:
+                return True, child
+        else:
+            child.expect(cfg['login_prompt'])
 
         child.sendline(cfg['username'])
         child.expect(cfg['password_prompt'])
         child.sendline(cfg['password'])
         child.expect(cfg['shell_prompt'])
 
-        # Write to log file
-        log_file.write(stdout)
-        log_file.flush()
-
         time.sleep(2)
 
-        return True, None
+        return True, child
 
     except pexpect.TIMEOUT as e:
         print(f"Timeout in console interaction: {e}")
@@ -155,6 +222,142 @@ def console_login(cfg, log_file):
         return False, f"Console error: {str(e)}"
 
 
+def agent_login(cfg, log_file):
+    """
+    Start the guest (or attach to it on resume) with the serial console
+    multiplexer copying the console into the log, and wait for the guest
+    agent to answer.
+    Returns the console multiplexer on success
+    """
+    running = cfg['resume'] and domain_is_running(cfg)
+    if running:
+        console_cmd = f"virsh console {cfg['name']} --force"
+    else:
+        console_cmd = f"virsh start {cfg['name']} --console"
+
+    print(f"Starting console capture with: {console_cmd}")
+    status, mux = console_mux.attach(cfg['name'], console_cmd, log_file, running=running)
+    if not status:
+        return False, mux
+
+    status, result = guest_agent.wait_ready(cfg['name'], cfg['boot_timeout'])
+    if not status:
+        mux.close()
+        return False, result
+    return True, mux
+
+
+def guest_login(cfg, log_file):
+    """
+    Get a session to the guest - console login, or with login_method: agent
+    the guest agent with the serial console as a passive capture
+    """
+    if cfg['login_method'] == 'agent':
+        return agent_login(cfg, log_file)
+    return console_login(cfg, log_file)
+
+
+def tuning_args(cfg):
+    """
+    virt-install args for vCPU/emulator pinning, NUMA memory binding,
+    hugepage backed memory and iothreads.
+    vcpu_pinning: "auto" reserves host CPUs in one NUMA node not used by
+    other auto-placed guests, or a host cpulist - pinned 1:1 when it has
+    one CPU per vCPU, else every vCPU floats over the whole list.
+    """
+    args = []
+    vcpus = int(cfg['vcpus'])
+    vcpu_cpus = emulator_cpus = None
+    nodeset = cfg['numa_nodeset']
+
+    if cfg['vcpu_pinning'] == "auto":
+        extra = 0 if cfg['emulator_pinning'] else 1
+        status, result = placement.reserve(cfg['name'], vcpus + extra)
+        if not status:
+            return False, result
+        print(f"Placement: {cfg['name']} on NUMA node {result['node']}, "
+              f"host CPUs {placement.format_cpulist(result['cpus'])}")
+        vcpu_cpus = result['cpus'][:vcpus]
+        emulator_cpus = result['cpus'][vcpus:]
+        if nodeset is None:
+            nodeset = str(result['node'])
+    elif cfg['vcpu_pinning']:
+        vcpu_cpus = placement.parse_cpulist(cfg['vcpu_pinning'])
+
+    if cfg['emulator_pinning']:
+        emulator_cpus = placement.parse_cpulist(cfg['emulator_pinning'])
+
+    cputune = []
+    if vcpu_cpus:
+        for vcpu in range(vcpus):
+            cpuset = vcpu_cpus[vcpu] if len(vcpu_cpus) == vcpus else placement.format_cpulist(vcpu_cpus)
+            cputune.append(f"vcpupin{vcpu}.vcpu={vcpu},vcpupin{vcpu}.cpuset={cpuset}")
+    if emulator_cpus:
+        cpuset = placement.format_cpulist(emulator_cpus)
+        cputune.append(f"emulatorpin.cpuset={cpuset}")
+        # iothreads run next to the emulator thread, away from the vCPUs
+        for i in range(int(cfg['iothreads'])):
+            cputune.append(f"iothreadpin{i}.iothread={i + 1},iothreadpin{i}.cpuset={cpuset}")
+    if cputune:
+        args.extend(["--cputune", ",".join(cputune)])
+
+    if nodeset is not None:
+        args.extend(["--numatune", f"memory.mode={cfg['numa_mode']},memory.nodeset={nodeset}"])
+
+    if cfg['hugepages']:
+        free_mb = placement.hugepages_free_mb(cfg['hugepage_size_kb'])
+        if free_mb < int(cfg['memory']):
+            return False, f"Not enough free hugepages: need {cfg['memory']} MiB, {free_mb} MiB free"
+        backing = "hugepages=on"
+        if cfg['hugepage_size_kb']:
+            backing += f",hugepages.page0.size={cfg['hugepage_size_kb']},hugepages.page0.unit=KiB"
+        args.extend(["--memorybacking", backing])
+
+    if int(cfg['iothreads']) > 0:
+        args.extend(["--iothreads", str(cfg['iothreads'])])
+
+    return True, args
+
+
+def disk_args(cfg):
+    """
+    virt-install args for the guest disk I/O stack:
+    disk_bus scsi (virtio-scsi controller) or virtio (virtio-blk),
+    disk_cache, disk_io (native, threads, io_uring), disk_discard,
+    disk_iothread and disk_queues
+    """
+    bus = cfg['disk_bus']
+    if bus not in ("scsi", "virtio"):
+        return False, f"Unsupported disk_bus: {bus}, use scsi or virtio"
+    if cfg['disk_io'] == "native" and cfg['disk_cache'] not in ("none", "directsync"):
+        return False, "disk_io: native needs disk_cache: none or directsync"
+    if cfg['disk_iothread'] and int(cfg['disk_iothread']) > int(cfg['iothreads']):
+        return False, f"disk_iothread {cfg['disk_iothread']} needs iothreads >= {cfg['disk_iothread']}"
+
+    # iothread and queues belong to the virtio-scsi controller, or to the virtio-blk disk
+    driver = []
+    if cfg['disk_iothread']:
+        driver.append(f"driver.iothread={cfg['disk_iothread']}")
+    if cfg['disk_queues']:
+        driver.append(f"driver.queues={cfg['disk_queues']}")
+
+    disk = [f"path={cfg['qcow_path']}", f"bus={bus}", "format=qcow2"]
+    if cfg['disk_cache']:
+        disk.append(f"cache={cfg['disk_cache']}")
+    if cfg['disk_io']:
+        disk.append(f"io={cfg['disk_io']}")
+    if cfg['disk_discard']:
+        disk.append(f"discard={cfg['disk_discard']}")
+
+    args = []
+    if bus == "scsi":
+        args.extend(["--controller", ",".join(["type=scsi,model=virtio-scsi"] + driver)])
+    else:
+        disk.extend(driver)
+    args.append(f"--disk={','.join(disk)}")
+    return True, args
+
+
 def virt_install(cfg):
     """
     Start the VM using - virt-install ..
@@ -170,6 +373,10 @@ def virt_install(cfg):
 
         accel = "kvm" if cfg["accelerator"].lower() == "kvm" else "tcg"
 
+        status, disk = disk_args(cfg)
+        if not status:
+            return False, disk
+
         virt_install_cmd = [
             "virt-install",
             "--connect=qemu:///system",
@@ -185,8 +392,8 @@ def virt_install(cfg):
             f"--os-variant={cfg['os_variant']}",
             "--console", "pty,target_type=serial",
             "--memballoon", "model=virtio",
-            "--controller", "type=scsi,model=virtio-scsi",
-            f"--disk=path={cfg['qcow_path']},bus=scsi,format=qcow2",
+            *(["--channel", guest_agent.AGENT_CHANNEL] if cfg['login_method'] == 'agent' else []),
+            *disk,
             f"--network=bridge={cfg['network_bridge']},model=virtio",
             f"--boot=emulator=/usr/bin/qemu-system-ppc64"
         ]
@@ -204,6 +411,11 @@ def virt_install(cfg):
 
         virt_install_cmd.append("--noreboot")
 
+        status, result = tuning_args(cfg)
+        if not status:
+            return False, result
+        virt_install_cmd.extend(result)
+
         if cfg["qemu-extra-args"]:
             virt_install_cmd.append(f"--qemu-commandline={cfg['qemu-extra-args']}")
         if cfg["features"]:
@@ -222,7 +434,13 @@ def virt_install(cfg):
             text=True
         )
         # Wait for process to complete or timeout
-        time.sleep(cfg['virt_install_timeout'])
+        define_start = time.monotonic()
+        while time.monotonic() - define_start < cfg['virt_install_timeout']:
+            if virt_install_process.poll() is not None:
+                break
+            time.sleep(0.5)
+        if cfg['run_info'] is not None:
+            cfg['run_info']['steps']['guest_define'] = time.monotonic() - define_start
 
         virt_install_process.poll()
         if virt_install_process.returncode is not None and virt_install_process.returncode != 0:
@@ -242,61 +460,23 @@ def check_call_traces(cfg, log_file):
     Check if any call traces are present in the console log
     """
 
-    # Define patterns to search for
-    error_patterns = [
-        # Kernel panics and oops
-        "Kernel panic",
-        "kernel BUG at",
-        "BUG: unable to handle",
-        "Oops:",
-        
-        # Call traces
-        "Call Trace:",
-        "Call trace:",
-        "Backtrace:",
-        
-        # Segmentation faults
-        "segmentation fault",
-        "segfault",
-        "SIGSEGV",
-        
-        # Other critical errors
-        "general protection fault",
-        "unable to mount root",
-        "VFS: Cannot open root device",
-        "Kernel panic - not syncing",
-        
-        # Out of memory
-        "Out of memory",
-        "OOM killer",
-        "oom-killer",
-        
-        # Hardware errors
-        "Machine check exception",
-        "MCE:",
-
-        # Soft lockup / hard lockup
-        "soft lockup",
-        "hard lockup",
-        "hung task",
-        
-        # Stack corruption
-        "stack-protector",
-        "stack overflow",
-        
-        # RCU stalls
-        "rcu_sched detected stalls",
-        "rcu_preempt detected stalls",
-    ]
-    
     try:
+        # Console output the multiplexer hasn't written to the log yet
+        mux = console_mux.get(cfg['name'])
+        if mux is not None:
+            mux.flush_log()
+            # A trace missing from the log must not pass as no trace
+            status, error = mux.log_status()
+            if not status:
+                return False, error
+
         log_file_path = log_file.name
         with open(log_file_path, 'r') as f:
             log_content = f.read()
         
         # Check for each error pattern
         found_errors = []
-        for pattern in error_patterns:
+        for pattern in log_archive.ERROR_PATTERNS:
             if pattern.lower() in log_content.lower():
                 found_errors.append(pattern)
 
@@ -311,21 +491,54 @@ def check_call_traces(cfg, log_file):
         return False, error_msg
   
 
-def check_guest_config(cfg, log_file):
+def check_guest_config(cfg, console):
     """
-    Check if guest configurations are right
+    Check if guest configurations are right - probe the guest facts
+    over the console session in one round trip and diff them with
+    vcpus, memory, cpu, cmdline and features of the suite. All probed
+    facts are stored with the run. With check_guest_config: warn a
+    mismatch is only reported.
     """
 
-    # Define dictonary to check for guest config
+    status, result = guest_probe.probe(console, cfg)
+    if not status:
+        return False, result
+
+    checks = guest_probe.diff_facts(result, cfg)
+    if cfg['run_info'] is not None:
+        cfg['run_info']['guest_facts'] = checks
+
+    mismatches = [
+        f"{name} expected {check['expected']} got {check['value']}"
+        for name, check in checks.items() if check['ok'] is False
+    ]
+    if mismatches:
+        if cfg['check_guest_config'] == "warn":
+            print(f"Warning: guest config mismatch: {', '.join(mismatches)}")
+            return True, None
+        return False, f"Guest config mismatch: {', '.join(mismatches)}"
+
+    print(f"Guest config verified: {', '.join(n for n, c in checks.items() if c['ok'] is not None)}")
+    return True, None
 
 
 def run_tool(config: dict):
     """
     guest_bringup.py
     1. Install guest via virt-install
-    2. Guest console login
+    2. Guest console login, after reading the image into the host page
+       cache with warm_image: true (timed apart from boot as image_warm).
+       With login_method: agent, wait for the guest agent instead and
+       only capture the serial console.
     3. Check for call traces after guest login
-    4. Check guest configurations
+    4. Check guest configurations (check_guest_config: true, or warn)
+    5. Run in-guest benchmarks listed in benchmarks, and report boot
+       phase and boot I/O timing with report_boot_phases: true
+
+    Each completed step is checkpointed under checkpoint_dir, with
+    resume: true the run continues from the first incomplete step
+    against the still defined guest. The checkpoint of a failed run is
+    only kept with checkpoint: true or when resuming.
     """
     status = True
     error = None
@@ -334,45 +547,136 @@ def run_tool(config: dict):
     cfg = DEFAULTS.copy()
     cfg.update({k: v for k, v in config.items() if v is not None})
 
-    # Setup console log file
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    console_log_file = f"console_{cfg['name']}_{timestamp}.log"
-    log_file = open(console_log_file, 'w')
-    log_file.write(f"Console log for {cfg['name']} - Started at {datetime.now()}\n")
+    if cfg['login_method'] not in ('console', 'agent'):
+        return False, f"Unknown login_method: {cfg['login_method']}, use console or agent"
+    login_step = "agent_ready" if cfg['login_method'] == 'agent' else "console_login"
+
+    # This run defines the guest, even if an earlier bringup of it was a cached pass
+    result_cache.take_absent(cfg['name'])
+
+    # Load checkpoint of a previous run, or start afresh
+    ckpt = checkpoint.checkpoint_path(f"guest_bringup_{cfg['name']}", cfg['checkpoint_dir'])
+    if not cfg['resume']:
+        checkpoint.clear_checkpoint(ckpt)
+
+    # Setup console log file, resumed runs keep appending to the previous one
+    console_log = checkpoint.step_done(ckpt, "console_log")
+    if console_log and os.path.exists(console_log['log_path']):
+        console_log_file = console_log['log_path']
+        print(f"Resuming with console log: {console_log_file}")
+        log_file = open(console_log_file, 'a')
+        log_file.write(f"\nConsole log resumed at {datetime.now()}\n")
+    else:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        console_log_file = f"console_{cfg['name']}_{timestamp}.log"
+        log_file = open(console_log_file, 'w')
+        log_file.write(f"Console log for {cfg['name']} - Started at {datetime.now()}\n")
+        checkpoint.mark_step(ckpt, "console_log", log_path=console_log_file)
     log_file.flush()
 
-    try:
-        # Restart libvirtd to ensure a clean state
-        status, error = restart_libvirtd(cfg)
-        if not status:
-            return status, error
+    run_info = cfg['run_info']
+    if run_info is not None:
+        run_info['log_path'] = console_log_file
 
-        # Disable KVM module in case of tcg mode
-        if cfg["disable_kvm"] == True:
-            status, error = disable_kvm(cfg)
+        # Learn boot/define timeouts from previous runs of this config
+        if cfg['adaptive_timeouts']:
+            adaptive_timeouts.apply(cfg, config, run_info['config_digest'])
+
+    console = None
+    try:
+        if checkpoint.step_done(ckpt, "host_prepared"):
+            print("Resume: host already prepared, skipping libvirtd restart")
+        else:
+            with run_history.step(run_info, "host_prepare"):
+                # Restart libvirtd to ensure a clean state
+                status, error = restart_libvirtd(cfg)
+                if not status:
+                    return status, error
+
+                # Disable KVM module in case of tcg mode
+                if cfg["disable_kvm"] == True:
+                    status, error = disable_kvm(cfg)
+                    if not status:
+                        return status, error
+            checkpoint.mark_step(ckpt, "host_prepared")
+
+        if checkpoint.step_done(ckpt, "guest_defined"):
+            print(f"Resume: guest {cfg['name']} already defined, skipping virt-install")
+        else:
+            # Start VM using virt_install function
+            with run_history.step(run_info, "virt_install"):
+                status, result = virt_install(cfg)
             if not status:
+                error = result
                 return status, error
+            checkpoint.mark_step(ckpt, "guest_defined")
+
+        if checkpoint.step_done(ckpt, "logged_in"):
+            print(f"Resume: already logged in to {cfg['name']}, skipping console login")
+        else:
+            # Warm the host page cache so boot time doesn't include cold image reads
+            if cfg['warm_image']:
+                with run_history.step(run_info, "image_warm"):
+                    warmed, result = image_prep.warm(cfg['qcow_path'])
+                if not warmed:
+                    print(f"Warning: {result}")
+
+            # Get into the guest via console login or the guest agent
+            with run_history.step(run_info, login_step):
+                status, result = guest_login(cfg, log_file)
+            if not status:
+                error = result
+                return status, error
+            console = result
+            if run_info is not None:
+                run_info['boot_time'] = run_info['steps'][login_step]
+            checkpoint.mark_step(ckpt, "logged_in")
+
+        if checkpoint.step_done(ckpt, "call_traces_checked"):
+            print("Resume: call traces already checked, skipping")
+        else:
+            # Check for any call traces in the log_file
+            with run_history.step(run_info, "check_call_traces"):
+                status, error = check_call_traces(cfg, log_file)
+            if not status:
+                return status, error
+            checkpoint.mark_step(ckpt, "call_traces_checked")
+
+        # Post-login stages need the console, attach to it when resumed after login
+        workloads = list(cfg['benchmarks'])
+        if cfg['report_boot_phases'] and "boot" not in workloads:
+            workloads.insert(0, "boot")
+        if console is None and (cfg['check_guest_config'] or workloads):
+            status, result = guest_login(cfg, log_file)
+            if not status:
+                error = result
+                return status, error
+            console = result
 
-        # Start VM using virt_install function
-        status, result = virt_install(cfg)
-        if not status:
-            error = result
-            return status, error
-
-        # Get into the guest console via console_login function
-        status, error = console_login(cfg, log_file)
-        if not status:
-            return status, error
+        # Check the guest got the requested configuration
+        if cfg['check_guest_config'] and not checkpoint.step_done(ckpt, "guest_config_checked"):
+            with run_history.step(run_info, "check_guest_config"):
+                status, error = check_guest_config(cfg, console)
+            if not status:
+                return status, error
+            checkpoint.mark_step(ckpt, "guest_config_checked")
 
-        # Check for any call traces in the log_file
-        status, error = check_call_traces(cfg, log_file)
-        if not status:
-            return status, error
+        # Characterize guest performance, failed workloads don't fail the bringup
+        if workloads:
+            with run_history.step(run_info, "benchmarks"):
+                metrics, errors = guest_benchmark.run_benchmarks(console, cfg, workloads)
+            if run_info is not None:
+                run_info['metrics'] = metrics
+            if errors:
+                print(f"Benchmark: {len(errors)} workload(s) failed: {'; '.join(errors)}")
 
     except Exception as e:
         status = False
         error = f"Unexpected error: {str(e)}"
     finally:
+        if console is not None:
+            console.close()
+        console_mux.close(cfg['name'])
         log_file.write(f"\nConsole log ended at {datetime.now()}\n")
         log_file.write(f"Final status: {'SUCCESS' if status else 'FAILED'}\n")
         if error:
@@ -380,5 +684,11 @@ def run_tool(config: dict):
         log_file.close()
         print(f"Console log saved to: {console_log_file}")
 
+        # Nothing left to resume once every step passed, or without checkpointing
+        if status or not (cfg['checkpoint'] or cfg['resume']):
+            checkpoint.clear_checkpoint(ckpt)
+        else:
+            print(f"Checkpoint kept at {ckpt}, rerun with --resume to continue")
+
     # Return simple status and error as expected by main.py and avocado-main.py
     return status, error
@@ -0,0 +1,82 @@
+import math
+import os
+from utils import run_history
+
+
+# suite param -> run_tool step whose recorded latency it bounds
+TIMEOUT_STEPS = {
+    "boot_timeout": "console_login",
+    "virt_install_timeout": "guest_define",
+}
+# boot step by login_method
+BOOT_STEPS = {
+    "console": "console_login",
+    "agent": "agent_ready",
+}
+HISTORY_RUNS = 50
+MARGIN_SECONDS = 5
+
+
+def host_load_factor():
+    """
+    1-minute load average per CPU, >1 means the host is oversubscribed
+    and guests boot proportionally slower
+    """
+    try:
+        return max(1.0, os.getloadavg()[0] / (os.cpu_count() or 1))
+    except OSError:
+        return 1.0
+
+
+def step_latencies(digest, step, runs=HISTORY_RUNS, db_path=run_history.HISTORY_DB):
+    """
+    Recorded durations of step over the last passed runs of a config, sorted
+    """
+    if not os.path.exists(db_path):
+        return []
+    conn = run_history.connect(db_path)
+    try:
+        rows = conn.execute(
+            "SELECT s.duration FROM runs r JOIN steps s ON s.run_id = r.id "
+            "WHERE r.config_digest = ? AND r.status = 'pass' AND s.step = ? "
+            "ORDER BY r.started_at DESC LIMIT ?",
+            (digest, step, runs)
+        ).fetchall()
+    finally:
+        conn.close()
+    return sorted(r[0] for r in rows)
+
+
+def learned_timeout(latencies, percentile, margin, load_factor, cap=None):
+    """
+    percentile of the recorded latencies plus a relative and a fixed margin,
+    scaled by host load and capped by the explicit suite value
+    """
+    base = run_history.percentile(latencies, percentile)
+    timeout = math.ceil((base * (1 + margin) + MARGIN_SECONDS) * load_factor)
+    if cap is not None:
+        timeout = min(timeout, cap)
+    return timeout
+
+
+def apply(cfg, explicit, digest):
+    """
+    Replace boot_timeout / virt_install_timeout in cfg with timeouts learned
+    from the run history of the config. explicit holds the suite yaml params,
+    whose timeout values act as caps. Configs with fewer than
+    adaptive_min_runs passed runs keep their configured timeouts.
+    """
+    load_factor = host_load_factor() if cfg["adaptive_load_factor"] else 1.0
+
+    steps = dict(TIMEOUT_STEPS, boot_timeout=BOOT_STEPS[cfg["login_method"]])
+    for param, step in steps.items():
+        latencies = step_latencies(digest, step)
+        if len(latencies) < cfg["adaptive_min_runs"]:
+            print(f"Adaptive timeouts | {param}: {len(latencies)} recorded runs, keeping {cfg[param]}s")
+            continue
+
+        timeout = learned_timeout(latencies, cfg["adaptive_percentile"], cfg["adaptive_margin"],
+                                  load_factor, explicit.get(param))
+        print(f"Adaptive timeouts | {param}: {cfg[param]}s -> {timeout}s "
+              f"(p{cfg['adaptive_percentile']} of {len(latencies)} runs, load factor {load_factor:.2f})")
+        cfg[param] = timeout
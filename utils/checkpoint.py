@@ -0,0 +1,73 @@
+import json
+import os
+import re
+import tempfile
+from datetime import datetime
+
+
+CHECKPOINT_DIR = "./results/checkpoints"
+
+
+def checkpoint_path(key, checkpoint_dir=CHECKPOINT_DIR):
+    """
+    Path of the checkpoint file for key (suite / guest identifier)
+    """
+    safe_key = re.sub(r"[^A-Za-z0-9_.-]", "_", key)
+    return os.path.join(checkpoint_dir, f"{safe_key}.json")
+
+
+def load_checkpoint(path):
+    """
+    Load checkpoint from path, returns empty checkpoint if not present
+    """
+    if not os.path.exists(path):
+        return {"steps": {}}
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Checkpoint: ignoring unreadable checkpoint {path}: {e}")
+        return {"steps": {}}
+
+
+def save_checkpoint(path, checkpoint):
+    """
+    Durably write checkpoint - write temp file, fsync and rename over path
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(checkpoint, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def mark_step(path, step, **data):
+    """
+    Record step as completed, along with any data needed to resume from it
+    """
+    checkpoint = load_checkpoint(path)
+    checkpoint["steps"][step] = {"completed_at": datetime.now().isoformat(), **data}
+    save_checkpoint(path, checkpoint)
+    print(f"Checkpoint: {step} completed")
+
+
+def step_done(path, step):
+    """
+    Returns the recorded data of step if completed, else None
+    """
+    return load_checkpoint(path)["steps"].get(step)
+
+
+def clear_checkpoint(path):
+    """
+    Remove checkpoint, called on fresh runs and once a run fully completes
+    """
+    if os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,548 @@
+"""
+console_mux.py - shared serial console of a domain with any number of readers
+
+A ConsoleMux attaches once to the guest console (a virsh console child on a
+pty, the pty device of the serial chardev or its unix socket) and fans the
+bytes out to subscribers attached and detached at any time:
+- callbacks in this process, e.g. the console log
+- pexpect sessions (login, guest probe, benchmarks), whose input goes to
+  the console
+- local clients of <SOCKET_DIR>/<domain>.sock, e.g. `attach` below for
+  interactive debugging of a running bringup
+
+Each chunk read from the console is shared as one read-only memoryview by
+every subscriber, nothing is copied per subscriber. Every subscriber gets
+its chunks from a bounded queue on its own thread, so a slow subscriber
+never stalls the console or the others: past its byte limit its oldest
+chunks are dropped (policy "drop") or it is detached (policy "disconnect").
+The console log queues without a limit (policy "keep"), it must not lose
+output.
+
+python3 utils/console_mux.py list
+python3 utils/console_mux.py attach <domain> [--read-only]    # Ctrl-] to detach
+"""
+
+import argparse
+import codecs
+import collections
+import glob
+import os
+import select
+import socket
+import stat
+import subprocess
+import sys
+import threading
+import xml.etree.ElementTree as ET
+
+import pexpect
+from pexpect import fdpexpect
+
+
+SOCKET_DIR = "./results/consoles"
+READ_SIZE = 65536
+# Bytes queued per subscriber before its policy applies
+QUEUE_LIMIT = 4 * 2**20
+# Recent console output replayed to socket clients when they attach
+BACKLOG = 64 * 1024
+POLL_INTERVAL = 0.5
+ESCAPE = b"\x1d"
+
+# Multiplexers of this process by domain
+_muxes = {}
+_muxes_lock = threading.Lock()
+
+
+class Subscriber:
+    """
+    One reader of the console: a bounded queue of chunks, delivered to
+    deliver(view) on its own thread
+    """
+
+    def __init__(self, mux, name, deliver, limit=QUEUE_LIMIT, policy="drop", on_close=None):
+        if policy not in ("drop", "disconnect", "keep"):
+            raise ValueError(f"Unknown subscriber policy: {policy}, use drop, disconnect or keep")
+        self.mux = mux
+        self.name = name
+        self.deliver = deliver
+        self.on_close = on_close
+        self.limit = limit
+        self.policy = policy
+        self.chunks = collections.deque()
+        self.queued = 0
+        self.dropped = 0
+        self.error = None
+        self.closed = False
+        self.done = threading.Condition()
+        self.thread = threading.Thread(target=self.run, name=f"console-{mux.name}-{name}", daemon=True)
+
+    def offer(self, view):
+        """
+        Queue a chunk, called by the console reader - never blocks on delivery
+        """
+        with self.done:
+            if self.closed:
+                return
+            if self.policy != "keep" and self.queued + len(view) > self.limit:
+                if self.policy == "disconnect":
+                    self.closed = True
+                    self.done.notify_all()
+                    print(f"Console mux | {self.mux.name}: {self.name} fell {self.queued} bytes behind, detached")
+                    return
+                while self.chunks and self.queued + len(view) > self.limit:
+                    self.queued -= len(self.chunks[0])
+                    self.dropped += len(self.chunks.popleft())
+            self.chunks.append(view)
+            self.queued += len(view)
+            self.done.notify_all()
+
+    def run(self):
+        while True:
+            with self.done:
+                while not self.chunks and not self.closed:
+                    self.done.wait()
+                if not self.chunks:
+                    break
+                view = self.chunks.popleft()
+            try:
+                self.deliver(view)
+            except Exception as e:
+                print(f"Console mux | {self.mux.name}: {self.name} detached: {str(e)}")
+                with self.done:
+                    self.error = str(e)
+                    self.closed = True
+                    self.chunks.clear()
+                    self.queued = 0
+                    self.done.notify_all()
+                break
+            with self.done:
+                self.queued -= len(view)
+                self.done.notify_all()
+        if self.dropped:
+            print(f"Console mux | {self.mux.name}: {self.name} fell behind, {self.dropped} bytes dropped")
+        self.mux.unsubscribe(self)
+        if self.on_close is not None:
+            self.on_close()
+
+    def flush(self, timeout=5):
+        """
+        Wait until every chunk queued so far is delivered
+        """
+        with self.done:
+            return self.done.wait_for(lambda: self.queued == 0 or self.closed, timeout)
+
+    def close(self, discard=False):
+        """
+        Stop after the chunks already queued, or right away with discard
+        """
+        with self.done:
+            self.closed = True
+            if discard:
+                self.chunks.clear()
+                self.queued = 0
+            self.done.notify_all()
+
+
+class Session(fdpexpect.fdspawn):
+    """
+    pexpect session on the console through the multiplexer, close() only
+    detaches it
+    """
+
+    def __init__(self, mux, sock, timeout):
+        self.mux = mux
+        self.sock = sock
+        super().__init__(sock.fileno(), timeout=timeout)
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        self.closed = True
+        self.child_fd = -1
+
+
+class ConsoleMux:
+    """
+    Single attachment to the console of a domain, see the module docstring
+    """
+
+    def __init__(self, name, fd, child=None, sock=None, serve=True):
+        self.name = name
+        self.fd = fd
+        self.child = child
+        self.sock = sock
+        self.subscribers = []
+        # Subscriber of the console log, see subscribe_log
+        self.log = None
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.backlog = collections.deque()
+        self.backlog_bytes = 0
+        self.closed = False
+        self.eof = False
+        self.server = None
+        self.socket_path = None
+        self.reader = threading.Thread(target=self.read_console, name=f"console-{name}", daemon=True)
+        if serve:
+            self.serve()
+
+    @classmethod
+    def spawn(cls, name, command, serve=True):
+        """
+        Attach through a console command, e.g. virsh start <vm> --console
+        """
+        child = pexpect.spawn(command)
+        return cls(name, child.child_fd, child=child, serve=serve)
+
+    @classmethod
+    def open(cls, name, path, serve=True):
+        """
+        Attach to the serial chardev of a running domain: its pty device
+        (virsh ttyconsole <vm>) or the path of a unix socket chardev
+        """
+        if stat.S_ISSOCK(os.stat(path).st_mode):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(path)
+            return cls(name, sock.fileno(), sock=sock, serve=serve)
+        return cls(name, os.open(path, os.O_RDWR | os.O_NOCTTY), serve=serve)
+
+    def start(self):
+        self.reader.start()
+        return self
+
+    def read_console(self):
+        while not self.closed:
+            try:
+                ready, _, _ = select.select([self.fd], [], [], POLL_INTERVAL)
+                if not ready:
+                    continue
+                chunk = os.read(self.fd, READ_SIZE)
+            except (OSError, ValueError):
+                chunk = b""
+            if not chunk:
+                break
+            view = memoryview(chunk)
+            with self.lock:
+                self.backlog.append(view)
+                self.backlog_bytes += len(view)
+                while self.backlog_bytes - len(self.backlog[0]) >= BACKLOG:
+                    self.backlog_bytes -= len(self.backlog.popleft())
+                subscribers = list(self.subscribers)
+            for subscriber in subscribers:
+                subscriber.offer(view)
+        # Console gone, readers finish with what they have queued
+        self.eof = True
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.close()
+
+    def write(self, data):
+        """
+        Send input to the console, from any subscriber
+        """
+        with self.write_lock:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(self.fd, view):]
+
+    def subscribe(self, name, deliver, limit=QUEUE_LIMIT, policy="drop", backlog=False, on_close=None):
+        """
+        Attach deliver(view) as a reader of the console, with the recent
+        output first when backlog is set. on_close() is called once it is
+        detached.
+        """
+        subscriber = Subscriber(self, name, deliver, limit, policy, on_close)
+        with self.lock:
+            if backlog:
+                for view in self.backlog:
+                    subscriber.offer(view)
+            if self.eof:
+                subscriber.close()
+            self.subscribers.append(subscriber)
+        subscriber.thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        subscriber.close()
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+
+    def subscribe_log(self, log_file):
+        """
+        Copy the console into an open text log file
+        """
+        # Characters split between chunks are decoded with the next chunk
+        decoder = codecs.getincrementaldecoder('utf-8')('replace')
+
+        def write_log(view):
+            log_file.write(decoder.decode(view))
+            log_file.flush()
+        self.log = self.subscribe("log", write_log, policy="keep")
+        return self.log
+
+    def log_status(self):
+        """
+        Whether the console log has all console output read so far.
+        Returns (True, None) or (False, error)
+        """
+        if self.log is None:
+            return True, None
+        if self.log.error is not None:
+            return False, f"Console log of {self.name} incomplete, writing it failed: {self.log.error}"
+        if self.log.dropped:
+            return False, f"Console log of {self.name} incomplete, {self.log.dropped} bytes dropped"
+        return True, None
+
+    def add_client(self, sock, name, backlog=False, read_only=False):
+        """
+        Subscribe a connected socket: console output is sent to it, what it
+        sends goes to the console
+        """
+        def hang_up():
+            # Client sees EOF, and its input thread stops
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+        subscriber = self.subscribe(name, sock.sendall, backlog=backlog, on_close=hang_up)
+
+        def forward_input():
+            while not subscriber.closed:
+                try:
+                    data = sock.recv(READ_SIZE)
+                except OSError:
+                    data = b""
+                if not data:
+                    break
+                if not read_only:
+                    self.write(data)
+            # Client gone, nothing left to send it
+            subscriber.close(discard=True)
+            self.unsubscribe(subscriber)
+            subscriber.thread.join()
+            sock.close()
+
+        threading.Thread(target=forward_input, name=f"console-{self.name}-{name}-input", daemon=True).start()
+        return subscriber
+
+    def session(self, timeout=30, backlog=False):
+        """
+        pexpect session on the console, for login and in-guest commands
+        """
+        ours, theirs = socket.socketpair()
+        self.add_client(ours, "session", backlog=backlog)
+        return Session(self, theirs, timeout)
+
+    def serve(self):
+        """
+        Accept local clients on <SOCKET_DIR>/<domain>.sock
+        """
+        os.makedirs(SOCKET_DIR, exist_ok=True)
+        self.socket_path = os.path.join(SOCKET_DIR, f"{self.name}.sock")
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.socket_path)
+        self.server.listen()
+
+        def accept():
+            clients = 0
+            while not self.closed:
+                try:
+                    conn, _ = self.server.accept()
+                except OSError:
+                    break
+                clients += 1
+                # First byte: "r" for a read-only client, "w" to also send input
+                conn.settimeout(5)
+                try:
+                    mode = conn.recv(1)
+                except OSError:
+                    conn.close()
+                    continue
+                conn.settimeout(None)
+                self.add_client(conn, f"client{clients}", backlog=True, read_only=mode != b"w")
+                print(f"Console mux | {self.name}: client{clients} attached")
+
+        threading.Thread(target=accept, name=f"console-{self.name}-accept", daemon=True).start()
+
+    def flush_log(self, timeout=5):
+        """
+        Wait until the console log has the console output read so far
+        """
+        if self.log is not None:
+            self.log.flush(timeout)
+
+    def close(self):
+        """
+        Detach from the console, after subscribers got what is queued
+        """
+        if self.closed:
+            return
+        self.closed = True
+        if self.server is not None:
+            # Wakes the accept thread
+            try:
+                self.server.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.server.close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+        if self.reader.is_alive():
+            self.reader.join(timeout=POLL_INTERVAL * 4)
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.flush()
+            subscriber.close()
+            subscriber.thread.join(timeout=5)
+        if self.child is not None:
+            self.child.close(force=True)
+        elif self.sock is not None:
+            self.sock.close()
+        else:
+            os.close(self.fd)
+        with _muxes_lock:
+            if _muxes.get(self.name) is self:
+                del _muxes[self.name]
+        print(f"Console mux | {self.name}: detached from console")
+
+
+def chardev_path(name):
+    """
+    Host side of the serial console of running domain name: its pty
+    (virsh ttyconsole) or the path of a unix socket chardev, None if
+    neither is available
+    """
+    result = subprocess.run(["virsh", "ttyconsole", name], capture_output=True, text=True)
+    if result.returncode == 0 and result.stdout.strip():
+        return result.stdout.strip()
+    result = subprocess.run(["virsh", "dumpxml", name], capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    try:
+        root = ET.fromstring(result.stdout)
+    except ET.ParseError:
+        return None
+    for chardev in root.findall("./devices/console") + root.findall("./devices/serial"):
+        source = chardev.find("source")
+        if chardev.get("type") == "unix" and source is not None and source.get("path"):
+            return source.get("path")
+    return None
+
+
+def attach(name, command, log_file=None, running=False):
+    """
+    Multiplexer of a domain in this process, created on first use. A
+    running domain is attached through its serial chardev, else (or if the
+    chardev can't be opened) through command.
+    Returns (True, mux) or (False, error)
+    """
+    mux = get(name)
+    if mux is not None:
+        if not mux.eof:
+            return True, mux
+        # Console closed by the guest or virsh, attach again
+        mux.close()
+    path = chardev_path(name) if running else None
+    try:
+        mux = None
+        if path:
+            try:
+                mux = ConsoleMux.open(name, path)
+                command = path
+            except OSError as e:
+                print(f"Console mux | {name}: can't open {path}, using {command}: {str(e)}")
+        if mux is None:
+            mux = ConsoleMux.spawn(name, command)
+    except Exception as e:
+        return False, f"Console attach failed: {str(e)}"
+    if log_file is not None:
+        mux.subscribe_log(log_file)
+    with _muxes_lock:
+        _muxes[name] = mux
+    mux.start()
+    print(f"Console mux | {name}: attached to {command}, clients on {mux.socket_path}")
+    return True, mux
+
+
+def get(name):
+    with _muxes_lock:
+        return _muxes.get(name)
+
+
+def close(name):
+    mux = get(name)
+    if mux is not None:
+        mux.close()
+
+
+def attach_terminal(name, read_only):
+    """
+    Bridge this terminal to the console socket of a domain
+    """
+    import termios
+    import tty
+
+    path = os.path.join(SOCKET_DIR, f"{name}.sock")
+    if not os.path.exists(path):
+        return False, f"No console multiplexer for {name} ({path})"
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(path)
+    sock.sendall(b"r" if read_only else b"w")
+    print(f"Attached to {name}{' read-only' if read_only else ''}, Ctrl-] to detach\r")
+
+    stdin = sys.stdin.fileno()
+    saved = termios.tcgetattr(stdin) if os.isatty(stdin) else None
+    try:
+        if saved is not None:
+            tty.setraw(stdin)
+        while True:
+            ready, _, _ = select.select([sock, stdin], [], [])
+            if sock in ready:
+                data = sock.recv(READ_SIZE)
+                if not data:
+                    break
+                os.write(sys.stdout.fileno(), data)
+            if stdin in ready:
+                data = os.read(stdin, 1024)
+                if not data or ESCAPE in data:
+                    break
+                if not read_only:
+                    sock.sendall(data)
+    finally:
+        if saved is not None:
+            termios.tcsetattr(stdin, termios.TCSADRAIN, saved)
+        sock.close()
+    print(f"\r\nDetached from {name}")
+    return True, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Console multiplexers of running bringups")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="Domains with a console multiplexer")
+    attach_parser = sub.add_parser("attach", help="Attach this terminal to the console of a domain")
+    attach_parser.add_argument("domain")
+    attach_parser.add_argument("--read-only", action="store_true", help="Only watch, don't send input")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        for path in sorted(glob.glob(os.path.join(SOCKET_DIR, "*.sock"))):
+            print(os.path.basename(path)[:-len(".sock")])
+        return
+    status, error = attach_terminal(args.domain, args.read_only)
+    if not status:
+        print(f"ERROR: {error}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+guest_agent.py - qemu-guest-agent control channel
+
+Readiness, command execution and file reads through the guest agent
+('virsh qemu-agent-command'), an alternative to driving the serial
+console with login/password/shell prompt regexes. Needs the guest
+agent channel (org.qemu.guest_agent.0) and qemu-guest-agent running in
+the guest.
+"""
+
+import base64
+import json
+import subprocess
+import time
+
+
+AGENT_CHANNEL = "unix,target.type=virtio,target.name=org.qemu.guest_agent.0"
+COMMAND_TIMEOUT = 10
+# Interval between pings while the agent channel is not connected yet
+CONNECT_INTERVAL = 0.5
+READ_CHUNK = 1024 * 1024
+
+
+def command(name, execute, arguments=None, timeout=COMMAND_TIMEOUT):
+    """
+    Send one agent command to domain name.
+    Returns (True, "return" value) or (False, error)
+    """
+    request = {"execute": execute}
+    if arguments is not None:
+        request["arguments"] = arguments
+    try:
+        result = subprocess.run(
+            ["virsh", "qemu-agent-command", name, json.dumps(request), "--timeout", str(int(max(1, timeout)))],
+            capture_output=True, text=True, timeout=timeout + 10
+        )
+    except subprocess.TimeoutExpired:
+        return False, f"{execute} timed out after {timeout}s"
+    if result.returncode != 0:
+        return False, result.stderr.strip().replace("error: ", "")
+    try:
+        return True, json.loads(result.stdout)["return"]
+    except (ValueError, KeyError) as e:
+        return False, f"Unexpected agent reply to {execute}: {str(e)}"
+
+
+def wait_ready(name, timeout):
+    """
+    Wait until the guest agent of domain name answers guest-ping.
+    Each ping blocks in libvirt until the agent answers, pings are only
+    repeated while the domain is still starting or the agent channel is
+    not connected yet.
+    Returns (True, seconds waited) or (False, error)
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    error = None
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False, f"Guest agent of {name} not ready after {timeout}s: {error}"
+        status, error = command(name, "guest-ping", timeout=remaining)
+        if status:
+            waited = time.monotonic() - start
+            print(f"Guest agent | {name} ready after {waited:.1f}s")
+            return True, waited
+        # "domain is not running" until the asynchronous virsh start got qemu up
+        if "failed to get domain" in error:
+            return False, f"Guest agent of {name} unreachable: {error}"
+        time.sleep(CONNECT_INTERVAL)
+
+
+def run(name, cmd, timeout):
+    """
+    Run a shell command in the guest via guest-exec, polling its status
+    with a growing interval. Commands still running at timeout are killed.
+    Returns (True, {"exitcode", "stdout", "stderr"}) or (False, error)
+    """
+    status, result = command(name, "guest-exec", {
+        "path": "/bin/sh", "arg": ["-c", cmd], "capture-output": True
+    })
+    if not status:
+        return False, f"guest-exec failed: {result}"
+    pid = result["pid"]
+
+    deadline = time.monotonic() + timeout
+    interval = 0.05
+    while True:
+        status, result = command(name, "guest-exec-status", {"pid": pid})
+        if not status:
+            return False, f"guest-exec-status failed: {result}"
+        if result.get("exited"):
+            break
+        if time.monotonic() >= deadline:
+            command(name, "guest-exec", {"path": "/bin/sh", "arg": ["-c", f"pkill -P {pid}; kill {pid}"]})
+            return False, f"Guest command timed out after {timeout}s"
+        time.sleep(interval)
+        interval = min(interval * 2, 1.0)
+
+    def decode(key):
+        return base64.b64decode(result.get(key, "")).decode("utf-8", "replace")
+
+    return True, {
+        "exitcode": result.get("exitcode", result.get("signal")),
+        "stdout": decode("out-data"),
+        "stderr": decode("err-data"),
+    }
+
+
+def read_file(name, path):
+    """
+    Read a guest file via guest-file-open/read/close.
+    Returns (True, content) or (False, error)
+    """
+    status, handle = command(name, "guest-file-open", {"path": path, "mode": "r"})
+    if not status:
+        return False, f"Failed to open {path} in guest: {handle}"
+    chunks = []
+    try:
+        while True:
+            status, result = command(name, "guest-file-read", {"handle": handle, "count": READ_CHUNK})
+            if not status:
+                return False, f"Failed to read {path} in guest: {result}"
+            chunks.append(base64.b64decode(result.get("buf-b64", "")))
+            if result.get("eof") or not result.get("count"):
+                break
+    finally:
+        command(name, "guest-file-close", {"handle": handle})
+    return True, b"".join(chunks).decode("utf-8", "replace")
+
+
+def ipv4_addresses(name):
+    """
+    Non-loopback IPv4 addresses reported by guest-network-get-interfaces.
+    Returns (True, [addresses]) or (False, error)
+    """
+    status, result = command(name, "guest-network-get-interfaces")
+    if not status:
+        return False, result
+    return True, [
+        addr["ip-address"]
+        for iface in result
+        for addr in iface.get("ip-addresses", [])
+        if addr.get("ip-address-type") == "ipv4" and not addr["ip-address"].startswith("127.")
+    ]
@@ -0,0 +1,261 @@
+import re
+import pexpect
+from utils import guest_probe
+from utils import guest_agent
+
+
+# Each workload prints key=value lines between markers, the markers are
+# printf'ed in pieces so the echoed command never matches them
+BEGIN_CMD = "printf '%s_%s\\n' VPBENCH BEGIN"
+END_CMD = "printf '%s_%s\\n' VPBENCH END"
+BEGIN_MARKER = "VPBENCH_BEGIN"
+END_MARKER = "VPBENCH_END"
+
+DD_RATE = re.compile(r"([\d.,]+)\s*([kMGT]?B)/s")
+DD_UNITS = {"B": 1e-6, "kB": 1e-3, "MB": 1, "GB": 1e3, "TB": 1e6}
+
+
+def _timed(key, cmd):
+    return (f"s=$(date +%s%N); {cmd} >/dev/null 2>&1; e=$(date +%s%N); "
+            f"printf '{key}=%s\\n' $((e-s))")
+
+
+def _dd(key, cmd):
+    return f"printf '{key}=%s\\n' \"$({cmd} 2>&1 | tail -1)\""
+
+
+def _dd_mb_s(line):
+    """
+    Throughput in MB/s from the summary line of dd
+    """
+    m = DD_RATE.search(line or "")
+    if not m:
+        return None
+    return float(m.group(1).replace(",", ".")) * DD_UNITS[m.group(2)]
+
+
+def cpu_command(opts):
+    n = opts.get("iterations", 5000000)
+    return "; ".join([
+        f"printf 'iterations=%s\\n' {n}",
+        _timed("int_ns", f"awk 'BEGIN {{ for (i = 0; i < {n}; i++) s += (i * 7) % 13; print s }}'"),
+        _timed("fp_ns", f"awk 'BEGIN {{ x = 1.0; for (i = 1; i < {n}; i++) x = x * 1.0000001 + 0.5 / i; print x }}'"),
+    ])
+
+
+def cpu_parse(raw, output):
+    n = int(raw["iterations"])
+    return {
+        "int_mops": (n / (int(raw["int_ns"]) / 1e9) / 1e6, "Mops/s"),
+        "fp_mops": (n / (int(raw["fp_ns"]) / 1e9) / 1e6, "Mops/s"),
+    }
+
+
+def memory_command(opts):
+    # memcpy between two buffers larger than the caches: mbw when installed,
+    # else the same STREAM style copy with python3
+    size_mb = opts.get("size_mb", 256)
+    repeats = opts.get("repeats", 5)
+    stream_copy = (f"import time; n = {size_mb} << 20; a = bytearray(n); b = bytearray(n); b[:] = a; "
+                   f"t = time.perf_counter(); [b.__setitem__(slice(None), a) for i in range({repeats})]; "
+                   f"print({repeats} * {size_mb} / (time.perf_counter() - t))")
+    return (f"if command -v mbw >/dev/null 2>&1; then "
+            f"printf 'method=mbw\\ncopy=%s\\n' \"$(mbw -q -n {repeats} -t0 {size_mb} | awk '/^AVG/ {{print $(NF-1)}}')\"; "
+            f"else printf 'method=python\\ncopy=%s\\n' \"$(python3 -c '{stream_copy}')\"; fi")
+
+
+def memory_parse(raw, output):
+    # MiB copied per second, as mbw reports it
+    return {"copy_bandwidth": (float(raw["copy"]) if raw.get("copy") else None, "MiB/s")}
+
+
+def disk_command(opts):
+    size_mb = opts.get("size_mb", 256)
+    path = opts.get("path", "/var/tmp/vpbench.img")
+    return "; ".join([
+        _dd("write", f"dd if=/dev/zero of={path} bs=1M count={size_mb} oflag=direct"),
+        "sync",
+        _dd("read", f"dd if={path} of=/dev/null bs=1M iflag=direct"),
+        f"rm -f {path}",
+    ])
+
+
+def disk_parse(raw, output):
+    return {
+        "write": (_dd_mb_s(raw.get("write")), "MB/s"),
+        "read": (_dd_mb_s(raw.get("read")), "MB/s"),
+    }
+
+
+def network_command(opts):
+    # Latency to the gateway by default, which is the host bridge for bridged guests,
+    # throughput only against an iperf3 server (iperf3 -s on the host)
+    target = opts.get("target") or "$(ip route | awk '/^default/ {print $3; exit}')"
+    count = opts.get("count", 20)
+    commands = [f"printf 'ping=%s\\n' \"$(ping -q -c {count} -i 0.2 {target} 2>&1 | tail -2 | tr '\\n' ' ')\""]
+    if opts.get("iperf3_server"):
+        seconds = opts.get("seconds", 5)
+        for key, reverse in (("send", ""), ("receive", " -R")):
+            commands.append(f"printf '{key}=%s\\n' \"$(iperf3 -c {opts['iperf3_server']} -t {seconds} -f m{reverse} 2>&1 "
+                            f"| awk '/receiver$/ {{print $(NF-2)}}')\"")
+    return "; ".join(commands)
+
+
+def network_parse(raw, output):
+    ping = raw.get("ping", "")
+    loss = re.search(r"([\d.]+)% packet loss", ping)
+    rtt = re.search(r"= [\d.]+/([\d.]+)/([\d.]+)/", ping)
+    metrics = {
+        "rtt_avg": (float(rtt.group(1)) if rtt else None, "ms"),
+        "rtt_max": (float(rtt.group(2)) if rtt else None, "ms"),
+        "packet_loss": (float(loss.group(1)) if loss else None, "%"),
+    }
+    for key in ("send", "receive"):
+        if key in raw:
+            metrics[f"{key}_throughput"] = (float(raw[key]) if raw[key] else None, "Mbit/s")
+    return metrics
+
+
+def boot_command(opts):
+    # Whole disks of the guest, virtio-scsi (sdX) or virtio-blk (vdX)
+    return "; ".join([
+        "printf 'analyze=%s\\n' \"$(systemd-analyze time 2>/dev/null | head -1)\"",
+        "awk '$3 ~ /^(sd|vd)[a-z]+$/ { r += $6; rt += $7; w += $10; wt += $11; io += $13 } "
+        "END { printf \"rd_sectors=%d\\nrd_ms=%d\\nwr_sectors=%d\\nwr_ms=%d\\nio_ms=%d\\n\", r, rt, w, wt, io }' "
+        "/proc/diskstats",
+    ])
+
+
+SPAN = re.compile(r"([\d.]+)(h|min|ms|us|s)\b")
+SPAN_UNITS = {"h": 3600, "min": 60, "s": 1, "ms": 1e-3, "us": 1e-6}
+
+
+def _span_seconds(text):
+    """
+    systemd time span, e.g. "1min 2.345s" -> 62.345
+    """
+    return sum(float(value) * SPAN_UNITS[unit] for value, unit in SPAN.findall(text))
+
+
+def boot_parse(raw, output):
+    # Startup finished in 1.2s (firmware) + 2.5s (kernel) + 3.1s (initrd) + 10.2s (userspace) = 17.0s
+    metrics = {}
+    analyze = raw.get("analyze", "")
+    for span, phase in re.findall(r"((?:[\d.]+(?:h|min|ms|us|s)\s*)+)\((\w+)\)", analyze):
+        metrics[f"{phase}_s"] = (_span_seconds(span), "s")
+    total = re.search(r"=\s*((?:[\d.]+(?:h|min|ms|us|s)\s*)+)", analyze)
+    if total:
+        metrics["total_s"] = (_span_seconds(total.group(1)), "s")
+
+    # diskstats counts 512 byte sectors
+    metrics["read_mb"] = (int(raw["rd_sectors"]) / 2048, "MB")
+    metrics["read_ms"] = (int(raw["rd_ms"]), "ms")
+    metrics["write_mb"] = (int(raw["wr_sectors"]) / 2048, "MB")
+    metrics["write_ms"] = (int(raw["wr_ms"]), "ms")
+    metrics["io_busy_ms"] = (int(raw["io_ms"]), "ms")
+    return metrics
+
+
+# Registered workloads - name: (command builder, output parser, default timeout)
+# Parsers get the key=value lines of the output as a dict and the raw output
+BENCHMARKS = {
+    "boot": (boot_command, boot_parse, 60),
+    "cpu": (cpu_command, cpu_parse, 300),
+    "memory": (memory_command, memory_parse, 120),
+    "disk": (disk_command, disk_parse, 300),
+    "network": (network_command, network_parse, 60),
+}
+
+
+def custom_parse(patterns):
+    """
+    Parser for a workload declared in the suite yaml with its own command:
+    metric: regex with one group, matched against the workload output
+    """
+    def parse(raw, output):
+        metrics = {}
+        for name, pattern in patterns.items():
+            m = re.search(pattern, output, re.MULTILINE)
+            metrics[name] = (float(m.group(1)) if m else None, "")
+        return metrics
+    return parse
+
+
+def resolve(entry):
+    """
+    Suite yaml benchmark entry -> (name, command, parser, timeout).
+    Entries are a workload name, or a mapping with name and options,
+    or name, command and metrics for a custom workload.
+    """
+    opts = {"name": entry} if isinstance(entry, str) else dict(entry)
+    name = opts["name"]
+    if "command" in opts:
+        return name, opts["command"], custom_parse(opts.get("metrics", {})), opts.get("timeout", 300)
+    if name not in BENCHMARKS:
+        raise ValueError(f"Unknown benchmark: {name}, known: {', '.join(BENCHMARKS)}")
+    command, parse, timeout = BENCHMARKS[name]
+    return name, command(opts), parse, opts.get("timeout", timeout)
+
+
+def run_one(child, cfg, name, command, parse, timeout):
+    """
+    Run one workload over the console session, or through the guest
+    agent with login_method: agent.
+    Returns (True, {metric: (value, unit)}) or (False, error)
+    """
+    if cfg['login_method'] == 'agent':
+        status, result = guest_agent.run(cfg['name'], f"{BEGIN_CMD}; {command}; {END_CMD}", timeout)
+        if not status:
+            return False, f"{name}: {result}"
+        output = result['stdout'].rsplit(BEGIN_MARKER, 1)[-1]
+        try:
+            return True, parse(guest_probe.parse_facts(output), output)
+        except (KeyError, ValueError, ZeroDivisionError) as e:
+            return False, f"{name} output could not be parsed: {str(e)}"
+
+    try:
+        child.sendline(f"{BEGIN_CMD}; {command}; {END_CMD}")
+        child.expect(END_MARKER, timeout=timeout)
+        output = child.before.decode('utf-8', 'replace')
+        child.expect(cfg['shell_prompt'])
+
+        output = output.replace("\r", "").rsplit(BEGIN_MARKER, 1)[-1]
+        return True, parse(guest_probe.parse_facts(output), output)
+
+    except pexpect.TIMEOUT:
+        # Interrupt the workload and get the prompt back for the next one
+        child.sendcontrol('c')
+        try:
+            child.expect(cfg['shell_prompt'], timeout=30)
+        except pexpect.TIMEOUT:
+            pass
+        return False, f"{name} timed out after {timeout}s"
+    except (KeyError, ValueError, ZeroDivisionError) as e:
+        return False, f"{name} output could not be parsed: {str(e)}"
+
+
+def run_benchmarks(child, cfg, workloads):
+    """
+    Run the benchmark workloads in the guest.
+    Returns ([{"benchmark", "metric", "value", "unit"}], [errors])
+    """
+    results = []
+    errors = []
+    for entry in workloads:
+        try:
+            name, command, parse, timeout = resolve(entry)
+        except (KeyError, ValueError) as e:
+            errors.append(str(e))
+            continue
+
+        print(f"Benchmark: running {name} (timeout {timeout}s)")
+        status, result = run_one(child, cfg, name, command, parse, timeout)
+        if not status:
+            print(f"Benchmark: {result}")
+            errors.append(result)
+            continue
+
+        for metric, (value, unit) in result.items():
+            print(f"Benchmark: {name}.{metric} = {value if value is None else round(value, 3)} {unit}")
+            results.append({"benchmark": name, "metric": metric, "value": value, "unit": unit})
+    return results, errors
@@ -0,0 +1,147 @@
+import re
+import pexpect
+from utils import guest_agent
+
+
+# Facts from /proc files: (fact, file, parse(content)). The console probe
+# reads them in the shell, with login_method: agent they are read through
+# guest-file-read.
+FILE_FACTS = [
+    ("memtotal_kb", "/proc/meminfo", lambda text: _first(r"^MemTotal:\s+(\d+)", text)),
+    ("cpu", "/proc/cpuinfo", lambda text: _first(r"^cpu\s*:\s*(.*)$", text)),
+    ("platform", "/proc/cpuinfo", lambda text: _first(r"^platform[^:]*:\s*(.*)$", text)),
+    ("cmdline", "/proc/cmdline", lambda text: text.strip()),
+    ("dt_model", "/proc/device-tree/model", lambda text: text.replace("\0", "").strip()),
+    ("dt_hypervisor", "/proc/device-tree/hypervisor/compatible", lambda text: text.replace("\0", " ").strip()),
+]
+
+# One batched command collecting all guest facts as key=value lines between
+# two markers. Markers are printf'ed in pieces so the echoed command itself
+# never matches them on the console.
+BEGIN_CMD = "printf '%s_%s\\n' VPPROBE BEGIN"
+END_CMD = "printf '%s_%s\\n' VPPROBE END"
+EXEC_CMDS = [
+    "printf 'nproc=%s\\n' \"$(nproc)\"",
+    "printf 'dt_cpu_nodes=%s\\n' \"$(ls /proc/device-tree/cpus 2>/dev/null | grep -c @)\"",
+    "printf 'kvm_hv=%s\\n' \"$([ -d /sys/module/kvm_hv ] || [ -e /dev/kvm ] && echo yes || echo no)\"",
+]
+FILE_CMDS = [
+    "printf 'memtotal_kb=%s\\n' \"$(awk '/^MemTotal:/ {print $2}' /proc/meminfo)\"",
+    "printf 'cpu=%s\\n' \"$(awk -F': ' '/^cpu[[:space:]]*:/ {print $2; exit}' /proc/cpuinfo)\"",
+    "printf 'platform=%s\\n' \"$(awk -F': ' '/^platform/ {print $2; exit}' /proc/cpuinfo)\"",
+    "printf 'cmdline=%s\\n' \"$(cat /proc/cmdline)\"",
+    "printf 'dt_model=%s\\n' \"$(tr -d '\\000' 2>/dev/null < /proc/device-tree/model)\"",
+    "printf 'dt_hypervisor=%s\\n' \"$(tr '\\000' ' ' 2>/dev/null < /proc/device-tree/hypervisor/compatible)\"",
+]
+PROBE_CMD = "; ".join([BEGIN_CMD, *EXEC_CMDS, *FILE_CMDS, END_CMD])
+AGENT_PROBE_CMD = "; ".join([BEGIN_CMD, *EXEC_CMDS, END_CMD])
+BEGIN_MARKER = "VPPROBE_BEGIN"
+END_MARKER = "VPPROBE_END"
+
+# cpu models the guest does not report by name
+PASSTHROUGH_CPUS = ("host", "host-model", "host-passthrough", "max")
+
+
+def parse_facts(text):
+    """
+    key=value lines after the begin marker -> dict
+    """
+    text = text.replace("\r", "")
+    if BEGIN_MARKER in text:
+        text = text.rsplit(BEGIN_MARKER, 1)[1]
+    facts = {}
+    for line in text.splitlines():
+        key, sep, value = line.partition("=")
+        if sep and key.isidentifier():
+            facts[key] = value.strip()
+    return facts
+
+
+def _first(pattern, text):
+    match = re.search(pattern, text, re.MULTILINE)
+    return match.group(1).strip() if match else ""
+
+
+def read_file_facts(name):
+    """
+    FILE_FACTS of domain name read through the guest agent, files missing in
+    the guest (no device tree) give empty facts as in the console probe
+    """
+    contents = {}
+    facts = {}
+    for fact, path, parse in FILE_FACTS:
+        if path not in contents:
+            status, content = guest_agent.read_file(name, path)
+            contents[path] = content if status else ""
+        facts[fact] = parse(contents[path])
+    return facts
+
+
+def probe(child, cfg):
+    """
+    Run the probe over a logged-in console session in a single round trip,
+    or through the guest agent with login_method: agent. Console output
+    reaches the console log through the console multiplexer.
+    Returns (True, facts) or (False, error)
+    """
+    if cfg['login_method'] == 'agent':
+        status, result = guest_agent.run(cfg['name'], AGENT_PROBE_CMD, cfg['probe_timeout'])
+        if not status:
+            return False, f"Guest probe failed: {result}"
+        output = result['stdout']
+    else:
+        try:
+            child.sendline(PROBE_CMD)
+            child.expect(END_MARKER, timeout=cfg['probe_timeout'])
+            output = child.before.decode('utf-8', 'replace')
+            child.expect(cfg['shell_prompt'])
+
+        except pexpect.TIMEOUT as e:
+            return False, f"Guest probe timeout: {str(e)}"
+        except pexpect.EOF as e:
+            return False, f"Console connection closed during guest probe: {str(e)}"
+
+    facts = parse_facts(output)
+    if cfg['login_method'] == 'agent':
+        facts.update(read_file_facts(cfg['name']))
+    if not facts:
+        return False, "Guest probe returned no facts"
+    return True, facts
+
+
+def diff_facts(facts, cfg):
+    """
+    Compare guest facts with the suite params.
+    Returns {check: {"value", "expected", "ok"}}, facts without a check
+    are included with expected and ok None
+    """
+    checks = {}
+
+    def check(name, value, expected, ok):
+        checks[name] = {"value": value, "expected": expected, "ok": bool(ok)}
+
+    nproc = facts.get("nproc", "")
+    check("vcpus", nproc, cfg['vcpus'], nproc.isdigit() and int(nproc) == int(cfg['vcpus']))
+
+    # MemTotal excludes kernel reserved memory, so allow a tolerance below the assigned size
+    memtotal = facts.get("memtotal_kb", "")
+    mem_mib = int(memtotal) // 1024 if memtotal.isdigit() else None
+    low = int(cfg['memory']) * (1 - cfg['memory_tolerance'])
+    check("memory", mem_mib, cfg['memory'], mem_mib is not None and low <= mem_mib <= int(cfg['memory']))
+
+    if str(cfg['cpu']).lower() not in PASSTHROUGH_CPUS:
+        cpu = facts.get("cpu", "")
+        check("cpu", cpu, cfg['cpu'], str(cfg['cpu']).lower() in cpu.lower())
+
+    if cfg['cmdline']:
+        guest_args = facts.get("cmdline", "").split()
+        missing = [arg for arg in cfg['cmdline'].split() if arg not in guest_args]
+        check("cmdline", facts.get("cmdline", ""), cfg['cmdline'], not missing)
+
+    if "nested-hv=on" in cfg['features']:
+        check("nested-hv", facts.get("kvm_hv"), "yes", facts.get("kvm_hv") == "yes")
+
+    for name, value in facts.items():
+        if name not in checks:
+            checks[name] = {"value": value, "expected": None, "ok": None}
+    return checks
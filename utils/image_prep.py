@@ -0,0 +1,250 @@
+"""
+image_prep.py - guest image preparation and page cache warming
+
+python3 utils/image_prep.py prepare guests/qcows/<image>.qcow2 [--sparsify] [--compress]
+        [--preallocation metadata|falloc|full] [--cluster-size 2M] [-o <out.qcow2> | --in-place]
+python3 utils/image_prep.py warm guests/qcows/<image>.qcow2
+python3 utils/image_prep.py [--manifest <dir>/manifest.json] manifest
+"""
+
+import argparse
+import errno
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import time
+from datetime import datetime
+
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST = os.path.join("./guests/qcows", MANIFEST_NAME)
+READ_CHUNK = 8 * 1024 * 1024
+
+
+def run_cmd(cmd):
+    print(f"Image prep | {' '.join(cmd)}")
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        return False, result.stderr.strip() or result.stdout.strip()
+    return True, result.stdout
+
+
+def sha256(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(READ_CHUNK), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def allocated(path):
+    """
+    Bytes actually allocated on disk, holes excluded
+    """
+    return os.stat(path).st_blocks * 512
+
+
+def image_info(path):
+    status, out = run_cmd(["qemu-img", "info", "--output=json", path])
+    return json.loads(out) if status else {}
+
+
+def manifest_path(image):
+    """
+    Manifest next to the image, where result_cache looks for its digest
+    """
+    return os.path.join(os.path.dirname(os.path.realpath(image)), MANIFEST_NAME)
+
+
+def update_manifest(image, entry, manifest=None):
+    manifest = manifest or manifest_path(image)
+    data = {}
+    if os.path.exists(manifest):
+        with open(manifest) as f:
+            data = json.load(f)
+    data[os.path.basename(image)] = entry
+    tmp_path = f"{manifest}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest)
+
+
+def prepare(src, out=None, sparsify=False, compress=False, preallocation=None,
+            cluster_size=None, in_place=False, manifest=None):
+    """
+    Sparsify (virt-sparsify, zeroes free filesystem blocks), then convert
+    into a fresh qcow2 - which drops unused clusters and defragments it -
+    with the requested compression, preallocation and cluster size,
+    check it and record its digest in the manifest (by default the one
+    next to the prepared image).
+    Returns (True, output path) or (False, error)
+    """
+    if compress and preallocation and preallocation != "off":
+        return False, "Compressed images can't be preallocated"
+    if not os.path.exists(src):
+        return False, f"Image not found: {src}"
+
+    if out is None:
+        stem, ext = os.path.splitext(src)
+        out = src if in_place else f"{stem}-prepared{ext or '.qcow2'}"
+    work = f"{out}.prep-tmp"
+    sparse_copy = f"{out}.sparsify-tmp"
+    start = time.monotonic()
+    src_allocated = allocated(src)
+
+    try:
+        source = src
+        if sparsify:
+            if shutil.which("virt-sparsify") is None:
+                return False, "virt-sparsify not found, install libguestfs-tools or drop --sparsify"
+            status, error = run_cmd(["cp", "--sparse=always", src, sparse_copy])
+            if not status:
+                return False, f"Copy for sparsify failed: {error}"
+            status, error = run_cmd(["virt-sparsify", "--in-place", sparse_copy])
+            if not status:
+                return False, f"virt-sparsify failed: {error}"
+            source = sparse_copy
+
+        options = []
+        if cluster_size:
+            options.append(f"cluster_size={cluster_size}")
+        if preallocation:
+            options.append(f"preallocation={preallocation}")
+        cmd = ["qemu-img", "convert", "-p", "-O", "qcow2"]
+        if compress:
+            cmd.append("-c")
+        if options:
+            cmd.extend(["-o", ",".join(options)])
+        status, error = run_cmd(cmd + [source, work])
+        if not status:
+            return False, f"qemu-img convert failed: {error}"
+
+        status, error = run_cmd(["qemu-img", "check", work])
+        if not status:
+            return False, f"qemu-img check failed on prepared image: {error}"
+
+        os.replace(work, out)
+    finally:
+        for tmp in (work, sparse_copy):
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    info = image_info(out)
+    entry = {
+        "sha256": sha256(out),
+        "size": os.path.getsize(out),
+        "allocated": allocated(out),
+        "virtual_size": info.get("virtual-size"),
+        "cluster_size": info.get("cluster-size"),
+        "source": os.path.basename(src),
+        "sparsified": sparsify,
+        "compressed": compress,
+        "preallocation": preallocation or "off",
+        "prepared_at": datetime.now().isoformat(),
+        "prepare_seconds": round(time.monotonic() - start, 1),
+    }
+    update_manifest(out, entry, manifest)
+    print(f"Image prep | {src} -> {out}: {src_allocated // 2**20} MiB -> "
+          f"{entry['allocated'] // 2**20} MiB allocated in {entry['prepare_seconds']}s, sha256 {entry['sha256'][:16]}")
+    return True, out
+
+
+def data_extents(fd, size):
+    """
+    Allocated (offset, length) ranges of a sparse file, whole file if the
+    filesystem can't report holes
+    """
+    offset = 0
+    while offset < size:
+        try:
+            start = os.lseek(fd, offset, os.SEEK_DATA)
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                # Only a hole left up to the end of the file
+                return
+            if e.errno not in (errno.EINVAL, errno.ENOTSUP, errno.EOPNOTSUPP):
+                raise
+            yield offset, size - offset
+            return
+        end = os.lseek(fd, start, os.SEEK_HOLE)
+        yield start, end - start
+        offset = end
+
+
+def warm(path):
+    """
+    Read the allocated extents of an image into the page cache ahead of boot.
+    Returns (True, {"seconds", "mb"}) or (False, error)
+    """
+    try:
+        start = time.monotonic()
+        read = 0
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            size = os.fstat(fd).st_size
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            for offset, length in data_extents(fd, size):
+                os.posix_fadvise(fd, offset, length, os.POSIX_FADV_WILLNEED)
+                end = offset + length
+                while offset < end:
+                    chunk = os.pread(fd, min(READ_CHUNK, end - offset), offset)
+                    if not chunk:
+                        break
+                    offset += len(chunk)
+                    read += len(chunk)
+        finally:
+            os.close(fd)
+        result = {"seconds": time.monotonic() - start, "mb": read / 2**20}
+        print(f"Image warm | {path}: {result['mb']:.0f} MiB in {result['seconds']:.1f}s")
+        return True, result
+    except OSError as e:
+        return False, f"Failed to warm {path}: {str(e)}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="VirtualPilot guest image preparation")
+    parser.add_argument("--manifest", help=f"Digest manifest (default: next to the prepared image, {MANIFEST} to show)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    prep = sub.add_parser("prepare", help="Convert, sparsify and compact an image")
+    prep.add_argument("image")
+    prep.add_argument("-o", "--output", help="Prepared image path (default: <image>-prepared.qcow2)")
+    prep.add_argument("--in-place", action="store_true", help="Replace the image once prepared")
+    prep.add_argument("--sparsify", action="store_true", help="Zero free filesystem blocks with virt-sparsify")
+    prep.add_argument("--compress", action="store_true", help="Write compressed clusters")
+    prep.add_argument("--preallocation", choices=["off", "metadata", "falloc", "full"])
+    prep.add_argument("--cluster-size", help="qcow2 cluster size, e.g. 64K, 2M")
+
+    warm_cmd = sub.add_parser("warm", help="Read an image into the page cache")
+    warm_cmd.add_argument("image")
+
+    sub.add_parser("manifest", help="Show the digest manifest")
+
+    args = parser.parse_args()
+
+    if args.command == "prepare":
+        status, result = prepare(args.image, args.output, args.sparsify, args.compress,
+                                 args.preallocation, args.cluster_size, args.in_place, args.manifest)
+    elif args.command == "warm":
+        status, result = warm(args.image)
+    else:
+        manifest = args.manifest or MANIFEST
+        if not os.path.exists(manifest):
+            print(f"No manifest at {manifest}")
+            return
+        with open(manifest) as f:
+            for image, entry in sorted(json.load(f).items()):
+                print(f"{image}: sha256 {entry['sha256'][:16]} allocated {entry['allocated'] // 2**20} MiB "
+                      f"cluster {entry['cluster_size']} prealloc {entry['preallocation']} "
+                      f"sparsified {entry['sparsified']} compressed {entry['compressed']}")
+        return
+
+    if not status:
+        print(f"ERROR: {result}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+job_queue.py - file based job queue between the coordinator and workers
+
+<queue>/workers/<worker>.json        capacity advertisement, refreshed every HEARTBEAT_INTERVAL
+<queue>/inbox/<worker>/<job>.json    jobs dispatched to a worker
+<queue>/running/<worker>/<job>.json  jobs claimed by a worker
+<queue>/specs/<job>.yaml             suite yaml of a job
+<queue>/events/<job>.jsonl           job events, streamed back to the coordinator
+<queue>/logs/<job>.log               job output
+<queue>/results/<job>.json           final job result
+
+Files are written under a temporary name and renamed, so readers never see
+partial files and a job is claimed by exactly one rename. The queue can be
+a local directory, or a shared filesystem for workers on several hosts
+(heartbeats then rely on synchronized clocks).
+"""
+
+import glob
+import json
+import os
+import platform
+import socket
+import subprocess
+import time
+
+
+QUEUE_DIR = "./results/queue"
+HEARTBEAT_INTERVAL = 2.0
+WORKER_TIMEOUT = 15.0
+POLL_INTERVAL = 0.5
+IMAGE_DIR = "./guests/qcows"
+
+# Guest resources of suites whose script doesn't set them
+BRINGUP_DEFAULTS = {"accelerator": "kvm", "memory": 4096, "vcpus": 4}
+
+
+def queue_path(queue, *parts):
+    path = os.path.join(queue, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def write_json(path, data):
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def read_json(path):
+    """
+    Contents of a queue file, None once it is gone
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def append_event(queue, job_id, event, **data):
+    with open(queue_path(queue, "events", f"{job_id}.jsonl"), "a") as f:
+        f.write(json.dumps({"t": time.time(), "event": event, **data}) + "\n")
+
+
+def read_events(queue, job_id, offset=0):
+    """
+    Events of a job written since offset - (events, new offset)
+    """
+    path = os.path.join(queue, "events", f"{job_id}.jsonl")
+    if not os.path.exists(path):
+        return [], offset
+    with open(path) as f:
+        f.seek(offset)
+        data = f.read()
+    # Only complete lines, a partly written event is read on the next poll
+    complete = data[:data.rfind("\n") + 1]
+    return [json.loads(line) for line in complete.splitlines()], offset + len(complete.encode())
+
+
+def host_capacity(reserved_mb=0, reserved_vcpus=0, overrides=None):
+    """
+    Resources this host offers to new suites, after those reserved by
+    guests of running or still defined suites
+    """
+    meminfo = {}
+    with open("/proc/meminfo") as f:
+        for line in f:
+            key, value = line.split(":", 1)
+            meminfo[key] = int(value.split()[0])
+
+    result = subprocess.run(["virsh", "list", "--all", "--name"], capture_output=True, text=True)
+    domains = result.stdout.split() if result.returncode == 0 else []
+
+    capacity = {
+        "host": socket.gethostname(),
+        "arch": platform.machine(),
+        "accelerators": ["kvm", "tcg"] if os.path.exists("/dev/kvm") else ["tcg"],
+        # MemAvailable already excludes running guests, which are counted in reserved_mb
+        "memory_mb": meminfo.get("MemTotal", 0) // 1024,
+        "vcpus": os.cpu_count() or 1,
+        "images": sorted(os.path.basename(p) for p in glob.glob(os.path.join(IMAGE_DIR, "*.qcow2"))),
+        "domains": domains,
+    }
+    capacity.update(overrides or {})
+    capacity["memory_mb"] -= reserved_mb
+    capacity["vcpus"] -= reserved_vcpus
+    return capacity
+
+
+def suite_requirements(suite_cfg):
+    """
+    What a suite needs from a worker. Bringups need the guest resources and
+    accelerator, nested suites the L0 domain, and suites acting on an
+    existing guest (bringdown) the worker that brought it up.
+    """
+    params = suite_cfg.get("params") or {}
+    script = os.path.basename(str(suite_cfg.get("script", "")))
+    # nested: true or the number of levels, the worker needs the first of them
+    nested = suite_cfg.get("nested") not in (None, False, 0)
+    l0_name = (params.get("nested_levels") or [{}])[0].get("l0_name", params.get("l0_name"))
+    req = {
+        "accelerator": None,
+        "memory_mb": 0,
+        "vcpus": 0,
+        "image": None,
+        "domain": l0_name if nested else None,
+        "guest": f"{l0_name}/{params.get('name')}" if nested else params.get("name"),
+        "bringup": script == "guest_bringup",
+        "bringdown": script == "guest_bringdown",
+    }
+    if script == "guest_bringup" and not nested:
+        req["accelerator"] = str(params.get("accelerator", BRINGUP_DEFAULTS["accelerator"])).lower()
+        req["memory_mb"] = int(params.get("memory", BRINGUP_DEFAULTS["memory"]))
+        req["vcpus"] = int(params.get("vcpus", BRINGUP_DEFAULTS["vcpus"]))
+        if params.get("qcow_path"):
+            req["image"] = os.path.basename(params["qcow_path"])
+    if req["accelerator"] not in (None, "kvm"):
+        req["accelerator"] = "tcg"
+    return req
+
+
+def job_domains(req):
+    """
+    Guests and L0 domains a suite acts on, suites sharing one run in
+    suites_to_run order
+    """
+    return {d for d in (req["guest"], req["domain"]) if d}
+
+
+def worker_alive(worker, now=None):
+    return (now or time.time()) - worker.get("heartbeat", 0) < WORKER_TIMEOUT
+
+
+def list_workers(queue):
+    """
+    Advertisements of the workers with a recent heartbeat
+    """
+    workers = {}
+    now = time.time()
+    for path in glob.glob(os.path.join(queue, "workers", "*.json")):
+        worker = read_json(path)
+        if worker and worker.get("accepting") and worker_alive(worker, now):
+            workers[worker["id"]] = worker
+    return workers
+
+
+def fits(worker, req, queued=(), busy=0):
+    """
+    Whether worker can take a job now. queued holds the requirements of
+    jobs dispatched to it that its advertisement doesn't account for yet,
+    busy the number of its jobs that haven't finished.
+    """
+    if max(len(worker["running"]), busy) >= worker["slots"]:
+        return False
+    if req["accelerator"] and req["accelerator"] not in worker["accelerators"]:
+        return False
+    if req["domain"] and req["domain"] not in worker["domains"]:
+        return False
+    memory = worker["memory_mb"] - sum(q["memory_mb"] for q in queued)
+    vcpus = worker["vcpus"] - sum(q["vcpus"] for q in queued)
+    return memory >= req["memory_mb"] and vcpus >= req["vcpus"]
+
+
+def best_fit(workers, req, queued, busy):
+    """
+    Worker for a job among those it fits: prefer workers with the guest
+    image cached, then the one left with the least free memory and vCPUs,
+    keeping larger workers free for larger guests.
+    queued: {worker id: [requirements not in its advertisement yet]}
+    busy: {worker id: unfinished jobs}
+    """
+    candidates = [w for w in workers.values()
+                  if fits(w, req, queued.get(w["id"], []), busy.get(w["id"], 0))]
+    if not candidates:
+        return None
+
+    def score(worker):
+        pending = queued.get(worker["id"], [])
+        return (
+            req["image"] is not None and req["image"] not in worker["images"],
+            worker["memory_mb"] - sum(q["memory_mb"] for q in pending) - req["memory_mb"],
+            worker["vcpus"] - sum(q["vcpus"] for q in pending) - req["vcpus"],
+        )
+    return min(candidates, key=score)["id"]
@@ -0,0 +1,368 @@
+"""
+log_archive.py - compressed console log archive with an index of matched signatures
+
+python3 utils/log_archive.py ingest [console_*.log ...]
+python3 utils/log_archive.py search "rcu_sched detected stalls" [--since-days 30]
+python3 utils/log_archive.py add-pattern "<pattern>" [...]
+python3 utils/log_archive.py patterns
+python3 utils/log_archive.py show <log name> [--offset N] [--context 20]
+"""
+
+import argparse
+import glob
+import gzip
+import os
+import re
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+
+ARCHIVE_DIR = "./results/console-archive"
+INDEX_DB = "index.db"
+MAX_OFFSETS = 100
+LOG_END_MARKER = "Console log ended at"
+
+# Signatures looked for in every console log, matched case-insensitively
+ERROR_PATTERNS = [
+    # Kernel panics and oops
+    "Kernel panic",
+    "kernel BUG at",
+    "BUG: unable to handle",
+    "Oops:",
+
+    # Call traces
+    "Call Trace:",
+    "Call trace:",
+    "Backtrace:",
+
+    # Segmentation faults
+    "segmentation fault",
+    "segfault",
+    "SIGSEGV",
+
+    # Other critical errors
+    "general protection fault",
+    "unable to mount root",
+    "VFS: Cannot open root device",
+    "Kernel panic - not syncing",
+
+    # Out of memory
+    "Out of memory",
+    "OOM killer",
+    "oom-killer",
+
+    # Hardware errors
+    "Machine check exception",
+    "MCE:",
+
+    # Soft lockup / hard lockup
+    "soft lockup",
+    "hard lockup",
+    "hung task",
+
+    # Stack corruption
+    "stack-protector",
+    "stack overflow",
+
+    # RCU stalls
+    "rcu_sched detected stalls",
+    "rcu_preempt detected stalls",
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS logs (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    archive_path TEXT NOT NULL,
+    run_time REAL NOT NULL,
+    archived_at REAL NOT NULL,
+    size INTEGER NOT NULL,
+    compressed_size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS patterns (
+    id INTEGER PRIMARY KEY,
+    pattern TEXT NOT NULL UNIQUE COLLATE NOCASE,
+    added_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS hits (
+    log_id INTEGER NOT NULL REFERENCES logs(id),
+    pattern_id INTEGER NOT NULL REFERENCES patterns(id),
+    count INTEGER NOT NULL,
+    PRIMARY KEY (pattern_id, log_id)
+);
+CREATE TABLE IF NOT EXISTS matches (
+    log_id INTEGER NOT NULL REFERENCES logs(id),
+    pattern_id INTEGER NOT NULL REFERENCES patterns(id),
+    offset INTEGER NOT NULL,
+    line TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS logs_run_time ON logs(run_time);
+CREATE UNIQUE INDEX IF NOT EXISTS matches_log_pattern_offset ON matches(log_id, pattern_id, offset);
+"""
+
+
+def connect(archive_dir=ARCHIVE_DIR):
+    os.makedirs(archive_dir, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(archive_dir, INDEX_DB), timeout=30)
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'matches_log_pattern'").fetchone():
+        # Indexes written before matches were unique may hold duplicates of overlapping scans
+        with conn:
+            conn.execute("DELETE FROM matches WHERE rowid NOT IN "
+                         "(SELECT MIN(rowid) FROM matches GROUP BY log_id, pattern_id, offset)")
+            conn.execute("DROP INDEX matches_log_pattern")
+    conn.executescript(SCHEMA)
+    if conn.execute("SELECT COUNT(*) FROM patterns").fetchone()[0] == 0:
+        with conn:
+            conn.executemany("INSERT OR IGNORE INTO patterns (pattern, added_at) VALUES (?, ?)",
+                             [(p, time.time()) for p in ERROR_PATTERNS])
+    return conn
+
+
+def scan(lines, patterns):
+    """
+    Match patterns (id, text) case-insensitively against an iterable of
+    byte lines, returns {pattern id: [count, [(offset, line), ...]]}
+    """
+    needles = [(pid, text.lower().encode()) for pid, text in patterns]
+    found = {}
+    offset = 0
+    for line in lines:
+        lowered = line.lower()
+        for pid, needle in needles:
+            if needle in lowered:
+                hit = found.setdefault(pid, [0, []])
+                hit[0] += 1
+                if len(hit[1]) < MAX_OFFSETS:
+                    hit[1].append((offset, line.decode("utf-8", "replace").rstrip()))
+        offset += len(line)
+    return found
+
+
+def scan_archived(archive_path, patterns):
+    """
+    Process pool worker - scan one compressed log for patterns
+    """
+    with gzip.open(archive_path, "rb") as f:
+        return archive_path, scan(f, patterns)
+
+
+def _store_hits(conn, log_id, found):
+    conn.executemany("INSERT OR REPLACE INTO hits (log_id, pattern_id, count) VALUES (?, ?, ?)",
+                     [(log_id, pid, hit[0]) for pid, hit in found.items()])
+    # A retro-scan overlapping the ingest of the same log finds the same matches
+    conn.executemany("INSERT OR IGNORE INTO matches (log_id, pattern_id, offset, line) VALUES (?, ?, ?, ?)",
+                     [(log_id, pid, off, line) for pid, hit in found.items() for off, line in hit[1]])
+
+
+def log_run_time(log_path):
+    """
+    Run start time from console_<name>_<YYYYmmdd_HHMMSS>.log, else the file mtime
+    """
+    m = re.search(r"_(\d{8}_\d{6})\.log$", log_path)
+    if m:
+        return datetime.strptime(m.group(1), "%Y%m%d_%H%M%S").timestamp()
+    return os.path.getmtime(log_path)
+
+
+def log_finished(log_path):
+    """
+    A console log is finished once run_tool() wrote its end marker
+    """
+    with open(log_path, "rb") as f:
+        f.seek(max(0, os.path.getsize(log_path) - 4096))
+        return LOG_END_MARKER.encode() in f.read()
+
+
+def ingest(log_path, archive_dir=ARCHIVE_DIR, conn=None):
+    """
+    Compress a finished console log into the archive, index it against
+    all known patterns and remove the original.
+    Returns (True, archive path) or (False, error)
+    """
+    try:
+        if not log_finished(log_path):
+            return False, f"Console log not finished yet: {log_path}"
+
+        own_conn = conn is None
+        conn = conn or connect(archive_dir)
+        try:
+            name = os.path.basename(log_path)
+            if conn.execute("SELECT 1 FROM logs WHERE name = ?", (name,)).fetchone():
+                return False, f"Console log already archived: {name}"
+
+            archive_path = os.path.join(archive_dir, f"{name}.gz")
+            patterns = conn.execute("SELECT id, pattern FROM patterns").fetchall()
+
+            # Compress and scan in the same pass over the log
+            with open(log_path, "rb") as src, gzip.open(archive_path, "wb") as dst:
+                def lines():
+                    for line in src:
+                        dst.write(line)
+                        yield line
+                found = scan(lines(), patterns)
+
+            with conn:
+                cur = conn.execute(
+                    "INSERT INTO logs (name, archive_path, run_time, archived_at, size, compressed_size) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (name, archive_path, log_run_time(log_path), time.time(),
+                     os.path.getsize(log_path), os.path.getsize(archive_path))
+                )
+                _store_hits(conn, cur.lastrowid, found)
+        finally:
+            if own_conn:
+                conn.close()
+
+        os.remove(log_path)
+        print(f"Archive | {log_path} -> {archive_path}")
+        return True, archive_path
+
+    except Exception as e:
+        return False, f"Failed to archive {log_path}: {str(e)}"
+
+
+def add_patterns(new_patterns, archive_dir=ARCHIVE_DIR, workers=None):
+    """
+    Register new patterns and retro-scan the whole archive for them
+    in parallel, one compressed log per task
+    """
+    conn = connect(archive_dir)
+    try:
+        added = []
+        with conn:
+            for pattern in new_patterns:
+                cur = conn.execute("INSERT OR IGNORE INTO patterns (pattern, added_at) VALUES (?, ?)",
+                                   (pattern, time.time()))
+                if cur.rowcount:
+                    added.append((cur.lastrowid, pattern))
+        if not added:
+            return 0
+
+        logs = dict(conn.execute("SELECT archive_path, id FROM logs").fetchall())
+        print(f"Archive | retro-scanning {len(logs)} logs for {len(added)} new pattern(s)")
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(scan_archived, path, added) for path in logs]
+            for future in futures:
+                archive_path, found = future.result()
+                with conn:
+                    _store_hits(conn, logs[archive_path], found)
+        return len(added)
+    finally:
+        conn.close()
+
+
+def search(pattern, since_days=None, archive_dir=ARCHIVE_DIR):
+    """
+    Archived logs matching pattern, answered from the index.
+    Returns [(log name, run time, count, first offset, first line)]
+    """
+    conn = connect(archive_dir)
+    try:
+        row = conn.execute("SELECT id FROM patterns WHERE pattern = ?", (pattern,)).fetchone()
+        if row is None:
+            conn.close()
+            add_patterns([pattern], archive_dir)
+            conn = connect(archive_dir)
+            row = conn.execute("SELECT id FROM patterns WHERE pattern = ?", (pattern,)).fetchone()
+
+        since = time.time() - since_days * 86400 if since_days else 0
+        return conn.execute(
+            "SELECT l.name, l.run_time, h.count, "
+            "(SELECT offset FROM matches m WHERE m.log_id = l.id AND m.pattern_id = h.pattern_id ORDER BY offset LIMIT 1), "
+            "(SELECT line FROM matches m WHERE m.log_id = l.id AND m.pattern_id = h.pattern_id ORDER BY offset LIMIT 1) "
+            "FROM hits h JOIN logs l ON l.id = h.log_id "
+            "WHERE h.pattern_id = ? AND l.run_time >= ? ORDER BY l.run_time DESC",
+            (row[0], since)
+        ).fetchall()
+    finally:
+        conn.close()
+
+
+def show(name, offset=0, context=20, archive_dir=ARCHIVE_DIR):
+    """
+    Print context lines of an archived log starting around offset
+    """
+    conn = connect(archive_dir)
+    try:
+        row = conn.execute("SELECT archive_path FROM logs WHERE name = ?", (name,)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        print(f"Console log not in archive: {name}")
+        return
+
+    with gzip.open(row[0], "rb") as f:
+        pos = 0
+        for line in f:
+            if pos + len(line) > offset:
+                if context <= 0:
+                    break
+                print(line.decode("utf-8", "replace").rstrip())
+                context -= 1
+            pos += len(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="VirtualPilot console log archive")
+    parser.add_argument("--archive-dir", default=ARCHIVE_DIR, help=f"Archive directory (default: {ARCHIVE_DIR})")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    ingest_cmd = sub.add_parser("ingest", help="Move finished console logs into the archive")
+    ingest_cmd.add_argument("logs", nargs="*", help="Console logs (default: console_*.log in cwd)")
+
+    search_cmd = sub.add_parser("search", help="Archived logs matching a pattern")
+    search_cmd.add_argument("pattern")
+    search_cmd.add_argument("--since-days", type=float, help="Only logs of runs in the last N days")
+
+    add_cmd = sub.add_parser("add-pattern", help="Index new patterns, retro-scanning the archive")
+    add_cmd.add_argument("patterns", nargs="+")
+    add_cmd.add_argument("--workers", type=int, help="Retro-scan processes (default: CPU count)")
+
+    sub.add_parser("patterns", help="List indexed patterns")
+
+    show_cmd = sub.add_parser("show", help="Print part of an archived log")
+    show_cmd.add_argument("name")
+    show_cmd.add_argument("--offset", type=int, default=0)
+    show_cmd.add_argument("--context", type=int, default=20)
+
+    args = parser.parse_args()
+
+    if args.command == "ingest":
+        conn = connect(args.archive_dir)
+        try:
+            for log_path in args.logs or sorted(glob.glob("console_*.log")):
+                status, result = ingest(log_path, args.archive_dir, conn)
+                if not status:
+                    print(f"Archive | skipped: {result}")
+        finally:
+            conn.close()
+
+    elif args.command == "search":
+        results = search(args.pattern, args.since_days, args.archive_dir)
+        for name, run_time, count, offset, line in results:
+            started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(run_time))
+            print(f"{started}  {count:>5}  {name}  @{offset}: {line}")
+        print(f"{len(results)} log(s) matched: {args.pattern}")
+
+    elif args.command == "add-pattern":
+        added = add_patterns(args.patterns, args.archive_dir, args.workers)
+        print(f"{added} new pattern(s) indexed")
+
+    elif args.command == "patterns":
+        conn = connect(args.archive_dir)
+        try:
+            for pattern, logs in conn.execute(
+                    "SELECT p.pattern, COUNT(h.log_id) FROM patterns p "
+                    "LEFT JOIN hits h ON h.pattern_id = p.id GROUP BY p.id ORDER BY p.id"):
+                print(f"{logs:>6}  {pattern}")
+        finally:
+            conn.close()
+
+    elif args.command == "show":
+        show(args.name, args.offset, args.context, args.archive_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+placement.py - host CPU / NUMA placement of guests
+
+Guests placed with vcpu_pinning: auto get CPU sets that don't overlap with
+other auto-placed guests on the host. Reservations are kept in a host-wide
+registry file, locked while it is updated. Each reservation records the
+bringup process that made it; entries of guests that are not defined and
+whose bringup process is gone (or that are older than STALE_AFTER) are
+dropped on the next reservation, so a guest still being defined keeps its
+CPUs.
+"""
+
+import fcntl
+import glob
+import json
+import os
+import re
+import subprocess
+import time
+from contextlib import contextmanager
+
+
+REGISTRY = "/var/tmp/virtualpilot-placement.json"
+# Seconds after which a reservation of a guest that never got defined is
+# dropped even if its owner pid is alive (pid reused or a hung bringup)
+STALE_AFTER = 6 * 3600
+
+
+def parse_cpulist(cpulist):
+    """
+    "0-3,8,10-11" -> [0, 1, 2, 3, 8, 10, 11]
+    """
+    cpus = []
+    for part in str(cpulist).strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-")
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def format_cpulist(cpus):
+    """
+    [0, 1, 2, 3, 8] -> "0-3,8"
+    """
+    ranges = []
+    for cpu in sorted(set(cpus)):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(str(a) if a == b else f"{a}-{b}" for a, b in ranges)
+
+
+def host_nodes():
+    """
+    {numa node: [online cpus]} of the host
+    """
+    with open("/sys/devices/system/cpu/online") as f:
+        online = set(parse_cpulist(f.read()))
+    nodes = {}
+    for path in sorted(glob.glob("/sys/devices/system/node/node*/cpulist")):
+        node = int(re.search(r"node(\d+)", path).group(1))
+        with open(path) as f:
+            cpus = [c for c in parse_cpulist(f.read()) if c in online]
+        if cpus:
+            nodes[node] = cpus
+    return nodes or {0: sorted(online)}
+
+
+def domain_defined(name):
+    result = subprocess.run(["virsh", "domstate", name], capture_output=True, text=True)
+    return result.returncode == 0
+
+
+def pid_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def is_stale(guest, reservation):
+    """
+    Whether the reservation of guest can be dropped: the guest is not
+    defined and no bringup is about to define it
+    """
+    if domain_defined(guest):
+        return False
+    age = time.time() - reservation.get("reserved_at", 0)
+    return not pid_alive(reservation.get("pid")) or age > STALE_AFTER
+
+
+@contextmanager
+def locked_registry(path=REGISTRY):
+    """
+    Registry of reservations {guest: {"node", "cpus", "pid", "reserved_at"}},
+    saved on exit
+    """
+    with open(f"{path}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            registry = {}
+            if os.path.exists(path):
+                with open(path) as f:
+                    registry = json.load(f)
+            yield registry
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(registry, f, indent=2)
+            os.replace(tmp_path, path)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def reserve(name, count, path=REGISTRY):
+    """
+    Reserve count host CPUs within one NUMA node for guest name, not
+    overlapping other guests. Prefers the node with the most free CPUs.
+    Returns (True, {"node", "cpus"}) or (False, error)
+    """
+    nodes = host_nodes()
+    with locked_registry(path) as registry:
+        for guest in list(registry):
+            if guest != name and is_stale(guest, registry[guest]):
+                print(f"Placement: dropping stale reservation of {guest}")
+                del registry[guest]
+        registry.pop(name, None)
+
+        used = {cpu for r in registry.values() for cpu in r["cpus"]}
+        free = {node: [c for c in cpus if c not in used] for node, cpus in nodes.items()}
+        node = max(free, key=lambda n: len(free[n]))
+        if len(free[node]) < count:
+            return False, (f"Not enough free host CPUs for {name}: need {count}, "
+                           f"at most {len(free[node])} free in one NUMA node")
+
+        reservation = {"node": node, "cpus": free[node][:count], "pid": os.getpid(), "reserved_at": time.time()}
+        registry[name] = reservation
+    return True, reservation
+
+
+def release(name, path=REGISTRY):
+    """
+    Drop the reservation of guest name, if any
+    """
+    if not os.path.exists(path):
+        return
+    with locked_registry(path) as registry:
+        if registry.pop(name, None) is not None:
+            print(f"Placement: released host CPUs of {name}")
+
+
+def hugepages_free_mb(size_kb=None):
+    """
+    Free hugepage memory in MiB, for the default size or size_kb pages
+    """
+    if size_kb:
+        pool = f"/sys/kernel/mm/hugepages/hugepages-{size_kb}kB/free_hugepages"
+        if not os.path.exists(pool):
+            return 0
+        with open(pool) as f:
+            return int(f.read()) * size_kb // 1024
+
+    meminfo = {}
+    with open("/proc/meminfo") as f:
+        for line in f:
+            key, value = line.split(":", 1)
+            meminfo[key] = int(value.split()[0])
+    return meminfo.get("HugePages_Free", 0) * meminfo.get("Hugepagesize", 0) // 1024
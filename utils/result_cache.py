@@ -0,0 +1,233 @@
+import hashlib
+import json
+import os
+import platform
+import subprocess
+import time
+import yaml
+
+
+CACHE_DIR = "./results/cache"
+DEFAULT_TTL = 24 * 60 * 60
+HITS_LOG = "hits.jsonl"
+IMAGE_DIGESTS = "images.json"
+# Guests whose bringup was a cached pass, so never defined
+ABSENT_GUESTS = "absent_guests.json"
+
+
+def _read_json(path, default):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def _write_json(path, data):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _image_backing_file(image_path):
+    """
+    Backing file of a qcow2 overlay, None without one or without qemu-img
+    """
+    try:
+        result = subprocess.run(["qemu-img", "info", "--output=json", image_path],
+                                capture_output=True, text=True, timeout=30)
+    except Exception:
+        return None
+    if result.returncode != 0:
+        return None
+    backing = json.loads(result.stdout).get("backing-filename")
+    if not backing:
+        return None
+    return os.path.join(os.path.dirname(image_path), backing)
+
+
+def image_digest(image_path, cache_dir=CACHE_DIR):
+    """
+    Digest identifying the guest image as it was before being booted.
+    Bringups write to the image, so a digest of its current content would
+    change with every run. In order:
+    - the sha256 image_prep.py recorded in the manifest next to the image
+    - the digest of its backing file, for guests booted from an overlay
+    - the sha256 pinned the first time the cache saw the image
+    After replacing an image, prepare it again or remove it from
+    results/cache/images.json.
+    """
+    if not image_path or not os.path.exists(image_path):
+        return None
+
+    real_path = os.path.realpath(image_path)
+    manifest = _read_json(os.path.join(os.path.dirname(real_path), "manifest.json"), {})
+    entry = manifest.get(os.path.basename(real_path))
+    if entry and entry.get("sha256"):
+        return entry["sha256"]
+
+    backing = _image_backing_file(real_path)
+    if backing:
+        return image_digest(backing, cache_dir)
+
+    digests_file = os.path.join(cache_dir, IMAGE_DIGESTS)
+    digests = _read_json(digests_file, {})
+    if real_path in digests:
+        return digests[real_path]["sha256"]
+
+    print(f"Cache | pinning digest of guest image: {real_path}")
+    sha = hashlib.sha256()
+    with open(real_path, "rb") as f:
+        for chunk in iter(lambda: f.read(4 * 1024 * 1024), b""):
+            sha.update(chunk)
+
+    digests[real_path] = {"sha256": sha.hexdigest(), "pinned_at": time.time()}
+    _write_json(digests_file, digests)
+    return sha.hexdigest()
+
+
+def _tool_version(cmd):
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
+        if result.returncode != 0:
+            return None
+        lines = result.stdout.strip().splitlines()
+        return lines[0] if lines else None
+    except Exception:
+        return None
+
+
+def host_versions():
+    """
+    QEMU, libvirt and host kernel versions that affect a suite result
+    """
+    return {
+        "qemu": _tool_version(["qemu-system-ppc64", "--version"]),
+        "libvirt": _tool_version(["virsh", "--version"]),
+        "libvirtd": _tool_version(["libvirtd", "--version"]),
+        "kernel": platform.release(),
+    }
+
+
+def cache_key(suite_cfg, cache_dir=CACHE_DIR):
+    """
+    Digest of everything a suite result depends on:
+    script, params, guest image content, QEMU/libvirt and host kernel versions
+    """
+    params = suite_cfg.get("params", {}) or {}
+    inputs = {
+        "script": suite_cfg.get("script"),
+        "params": params,
+        "image": image_digest(params.get("qcow_path"), cache_dir),
+        "versions": host_versions(),
+    }
+    blob = json.dumps(inputs, sort_keys=True, default=str)
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+
+def lookup(key, ttl=DEFAULT_TTL, cache_dir=CACHE_DIR):
+    """
+    Returns the cached pass entry for key if younger than ttl seconds, else None
+    """
+    entry = _read_json(os.path.join(cache_dir, f"{key}.json"), None)
+    if entry is None:
+        return None
+    if time.time() - entry["passed_at"] > ttl:
+        return None
+    return entry
+
+
+def record_pass(key, suite, duration, cache_dir=CACHE_DIR):
+    """
+    Store a passing suite run under key
+    """
+    _write_json(os.path.join(cache_dir, f"{key}.json"), {
+        "suite": suite,
+        "passed_at": time.time(),
+        "duration": duration,
+    })
+
+
+def mark_absent(guest, cache_dir=CACHE_DIR):
+    """
+    Record that a cached-pass bringup didn't define guest
+    """
+    path = os.path.join(cache_dir, ABSENT_GUESTS)
+    absent = _read_json(path, {})
+    absent[guest] = time.time()
+    _write_json(path, absent)
+
+
+def take_absent(guest, cache_dir=CACHE_DIR):
+    """
+    Whether guest was left undefined by a cached-pass bringup, clearing the mark
+    """
+    path = os.path.join(cache_dir, ABSENT_GUESTS)
+    absent = _read_json(path, {})
+    if guest not in absent:
+        return False
+    del absent[guest]
+    _write_json(path, absent)
+    return True
+
+
+def guests_needed_later(suites_to_run):
+    """
+    Bringup suites of suites_to_run whose guest a later suite uses, other
+    than by bringing it down: a nested suite running on it as L0, or a suite
+    acting on it. A cached pass would leave those suites with no guest, so
+    the bringups are run without the cache.
+    """
+    suites = []
+    for path in suites_to_run:
+        with open(path) as f:
+            suite_cfg = yaml.safe_load(f) or {}
+        params = suite_cfg.get("params") or {}
+        nested = suite_cfg.get("nested") not in (None, False, 0)
+        suites.append({
+            "path": path,
+            "script": os.path.basename(str(suite_cfg.get("script", ""))),
+            "guest": None if nested else params.get("name"),
+            "l0_name": (params.get("nested_levels") or [{}])[0].get("l0_name", params.get("l0_name")) if nested else None,
+        })
+
+    uncached = set()
+    for idx, suite in enumerate(suites):
+        if suite["script"] != "guest_bringup" or not suite["guest"]:
+            continue
+        for later in suites[idx + 1:]:
+            if later["l0_name"] == suite["guest"] or (
+                    later["guest"] == suite["guest"] and later["script"] not in ("guest_bringup", "guest_bringdown")):
+                print(f"Cache | {suite['path']} runs uncached, {later['path']} needs its guest")
+                uncached.add(suite["path"])
+                break
+    return uncached
+
+
+def record_hit(suite, entry, cache_dir=CACHE_DIR):
+    """
+    Append a cache hit with the wall time it saved, read back by saved_since()
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(os.path.join(cache_dir, HITS_LOG), "a") as f:
+        f.write(json.dumps({"suite": suite, "at": time.time(), "saved": entry["duration"]}) + "\n")
+
+
+def saved_since(start, cache_dir=CACHE_DIR):
+    """
+    Returns (number of cached-pass suites, wall time saved) since start
+    """
+    hits = 0
+    saved = 0.0
+    try:
+        with open(os.path.join(cache_dir, HITS_LOG)) as f:
+            for line in f:
+                hit = json.loads(line)
+                if hit["at"] >= start:
+                    hits += 1
+                    saved += hit["saved"]
+    except (OSError, ValueError):
+        pass
+    return hits, saved
@@ -0,0 +1,340 @@
+"""
+run_history.py - persistent store of suite runs with boot time regression detection
+
+python3 utils/run_history.py runs [--suite <name>] [--limit N]
+python3 utils/run_history.py trends [--suite <name>]
+python3 utils/run_history.py metrics [--suite <name>] [--by accelerator,disk_bus,disk_cache]
+python3 utils/run_history.py regressions [--limit N]
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+
+HISTORY_DB = "./results/history.db"
+BASELINE_RUNS = 20
+REGRESSION_THRESHOLD = 0.5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    suite TEXT NOT NULL,
+    script TEXT,
+    config_digest TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    duration REAL,
+    status TEXT NOT NULL,
+    error TEXT,
+    log_path TEXT,
+    boot_time REAL,
+    baseline REAL,
+    regression INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS steps (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    step TEXT NOT NULL,
+    duration REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS guest_facts (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    fact TEXT NOT NULL,
+    value TEXT,
+    expected TEXT,
+    ok INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS guest_facts_run ON guest_facts(run_id);
+CREATE TABLE IF NOT EXISTS metrics (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    benchmark TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    value REAL,
+    unit TEXT
+);
+CREATE INDEX IF NOT EXISTS metrics_run ON metrics(run_id);
+CREATE TABLE IF NOT EXISTS configs (
+    config_digest TEXT PRIMARY KEY,
+    script TEXT,
+    params TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS attachments (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    kind TEXT NOT NULL,
+    path TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS attachments_run ON attachments(run_id);
+CREATE INDEX IF NOT EXISTS metrics_name ON metrics(benchmark, metric);
+CREATE INDEX IF NOT EXISTS runs_started ON runs(started_at);
+CREATE INDEX IF NOT EXISTS runs_config_started ON runs(config_digest, started_at);
+CREATE INDEX IF NOT EXISTS runs_suite_started ON runs(suite, started_at);
+CREATE INDEX IF NOT EXISTS runs_config_boot ON runs(config_digest, status, boot_time);
+CREATE INDEX IF NOT EXISTS runs_regression ON runs(regression, started_at);
+CREATE INDEX IF NOT EXISTS steps_run ON steps(run_id);
+"""
+
+# Keys that don't change what a suite does - injected by the orchestrator,
+# or timeouts that may be learned from the history itself
+RUNTIME_PARAMS = ("resume", "no_cache", "run_info", "boot_timeout", "virt_install_timeout")
+
+
+def connect(db_path=HISTORY_DB):
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def config_params(suite_cfg):
+    return {k: v for k, v in (suite_cfg.get("params") or {}).items() if k not in RUNTIME_PARAMS}
+
+
+def config_digest(suite_cfg):
+    """
+    Digest of the suite script and params, identifies runs of the same config
+    """
+    blob = json.dumps({"script": suite_cfg.get("script"), "params": config_params(suite_cfg)},
+                      sort_keys=True, default=str)
+    return hashlib.sha256(blob.encode()).hexdigest()[:16]
+
+
+def new_run_info(digest=None):
+    """
+    Per run record filled in by run_tool() - step durations, console log,
+    boot time, the guest facts checked against the suite params, the
+    in-guest benchmark metrics and files attached to the run by kind
+    """
+    return {"config_digest": digest, "steps": {}, "log_path": None, "boot_time": None,
+            "guest_facts": {}, "metrics": [], "attachments": {}}
+
+
+@contextmanager
+def step(run_info, name):
+    """
+    Time a run_tool step into run_info, no-op when run_info is None
+    """
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        if run_info is not None:
+            run_info["steps"][name] = time.monotonic() - start
+
+
+def percentile(values, pct):
+    """
+    Nearest-rank percentile of an already sorted list
+    """
+    if not values:
+        return None
+    rank = max(0, min(len(values) - 1, math.ceil(pct / 100.0 * len(values)) - 1))
+    return values[rank]
+
+
+def boot_baseline(conn, digest, runs=BASELINE_RUNS):
+    """
+    Rolling baseline - median boot time of the last passed runs of a config
+    """
+    rows = conn.execute(
+        "SELECT boot_time FROM runs WHERE config_digest = ? AND status = 'pass' "
+        "AND boot_time IS NOT NULL ORDER BY started_at DESC LIMIT ?",
+        (digest, runs)
+    ).fetchall()
+    return percentile(sorted(r[0] for r in rows), 50)
+
+
+def record_run(suite, suite_cfg, started_at, duration, status, error, run_info=None,
+               db_path=HISTORY_DB, threshold=REGRESSION_THRESHOLD):
+    """
+    Append a suite run to the history store and flag a boot time regression
+    if it is more than threshold above its rolling baseline.
+    Returns (run id, regression message or None)
+    """
+    run_info = run_info or new_run_info()
+    digest = config_digest(suite_cfg)
+    boot_time = run_info.get("boot_time")
+    regression = None
+
+    conn = connect(db_path)
+    try:
+        baseline = boot_baseline(conn, digest)
+        if status == "pass" and boot_time is not None and baseline:
+            if boot_time > baseline * (1 + threshold):
+                regression = (f"boot time {boot_time:.1f}s is {(boot_time / baseline - 1) * 100:.0f}% "
+                              f"above baseline {baseline:.1f}s for config {digest}")
+
+        with conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO configs (config_digest, script, params) VALUES (?, ?, ?)",
+                (digest, suite_cfg.get("script"), json.dumps(config_params(suite_cfg), sort_keys=True, default=str))
+            )
+            cur = conn.execute(
+                "INSERT INTO runs (suite, script, config_digest, started_at, duration, status, error, "
+                "log_path, boot_time, baseline, regression) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (suite, suite_cfg.get("script"), digest, started_at, duration, status, error,
+                 run_info.get("log_path"), boot_time, baseline, 1 if regression else 0)
+            )
+            run_id = cur.lastrowid
+            conn.executemany(
+                "INSERT INTO steps (run_id, step, duration) VALUES (?, ?, ?)",
+                [(run_id, name, d) for name, d in run_info["steps"].items()]
+            )
+            conn.executemany(
+                "INSERT INTO guest_facts (run_id, fact, value, expected, ok) VALUES (?, ?, ?, ?, ?)",
+                [(run_id, fact, str(c["value"]), None if c["expected"] is None else str(c["expected"]),
+                  0 if c["ok"] is False else 1)
+                 for fact, c in run_info.get("guest_facts", {}).items()]
+            )
+            conn.executemany(
+                "INSERT INTO metrics (run_id, benchmark, metric, value, unit) VALUES (?, ?, ?, ?, ?)",
+                [(run_id, m["benchmark"], m["metric"], m["value"], m["unit"])
+                 for m in run_info.get("metrics", [])]
+            )
+            conn.executemany(
+                "INSERT INTO attachments (run_id, kind, path) VALUES (?, ?, ?)",
+                [(run_id, kind, path) for kind, path in run_info.get("attachments", {}).items()]
+            )
+    finally:
+        conn.close()
+
+    if regression:
+        print(f"History | REGRESSION in {suite}: {regression}")
+    return run_id, regression
+
+
+def _fmt(value):
+    return "-" if value is None else f"{value:.1f}"
+
+
+def show_runs(conn, suite=None, limit=20):
+    query = ("SELECT id, suite, config_digest, started_at, duration, status, boot_time, regression, log_path "
+             "FROM runs")
+    args = []
+    if suite:
+        query += " WHERE suite = ?"
+        args.append(suite)
+    query += " ORDER BY started_at DESC LIMIT ?"
+    args.append(limit)
+
+    print(f"{'id':>6}  {'started':19}  {'status':6}  {'duration':>8}  {'boot':>6}  {'config':16}  suite")
+    for run_id, name, digest, started, duration, status, boot, regression, log_path in conn.execute(query, args):
+        flag = " REGRESSION" if regression else ""
+        started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(started))
+        print(f"{run_id:>6}  {started}  {status:6}  {_fmt(duration):>8}  {_fmt(boot):>6}  {digest:16}  {name}{flag}")
+        steps = conn.execute("SELECT step, duration FROM steps WHERE run_id = ?", (run_id,)).fetchall()
+        if steps:
+            print("        steps: " + ", ".join(f"{s}={d:.1f}s" for s, d in steps))
+        facts = conn.execute("SELECT fact, value, expected, ok FROM guest_facts WHERE run_id = ?",
+                             (run_id,)).fetchall()
+        if facts:
+            print("        guest: " + ", ".join(
+                f"{f}={v}" + (f" (expected {e})" if ok == 0 else "") for f, v, e, ok in facts))
+        if log_path:
+            print(f"        log: {log_path}")
+        for kind, path in conn.execute("SELECT kind, path FROM attachments WHERE run_id = ?", (run_id,)):
+            print(f"        {kind}: {path}")
+
+
+def show_trends(conn, suite=None):
+    query = "SELECT config_digest, suite, COUNT(*), SUM(status = 'pass'), MAX(started_at) FROM runs"
+    args = []
+    if suite:
+        query += " WHERE suite = ?"
+        args.append(suite)
+    query += " GROUP BY config_digest, suite ORDER BY suite"
+
+    print(f"{'config':16}  {'runs':>6}  {'pass%':>6}  {'p50 boot':>8}  {'p95 boot':>8}  {'last':19}  suite")
+    for digest, name, runs, passed, last in conn.execute(query, args).fetchall():
+        boots = [r[0] for r in conn.execute(
+            "SELECT boot_time FROM runs WHERE config_digest = ? AND status = 'pass' "
+            "AND boot_time IS NOT NULL ORDER BY boot_time", (digest,))]
+        last = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(last))
+        print(f"{digest:16}  {runs:>6}  {passed * 100.0 / runs:>6.1f}  {_fmt(percentile(boots, 50)):>8}  "
+              f"{_fmt(percentile(boots, 95)):>8}  {last}  {name}")
+
+
+def show_metrics(conn, suite=None, by=None):
+    """
+    p50/p95 of each benchmark metric per suite and config, e.g. to compare
+    kvm, tcg and nested kvm guests. by: suite params to label and group
+    configs with instead of their digest, e.g. accelerator,disk_bus,disk_cache
+    """
+    query = ("SELECT r.suite, r.config_digest, m.benchmark, m.metric, m.unit, m.value, c.params "
+             "FROM metrics m JOIN runs r ON r.id = m.run_id "
+             "LEFT JOIN configs c ON c.config_digest = r.config_digest WHERE m.value IS NOT NULL")
+    args = []
+    if suite:
+        query += " AND r.suite = ?"
+        args.append(suite)
+    query += " ORDER BY m.benchmark, m.metric, r.suite, r.config_digest, m.value"
+
+    groups = {}
+    for name, digest, benchmark, metric, unit, value, params in conn.execute(query, args):
+        if by:
+            params = json.loads(params or "{}")
+            name = ",".join(f"{k}={params.get(k)}" for k in by)
+            digest = "-"
+        groups.setdefault((benchmark, metric, unit, name, digest), []).append(value)
+
+    print(f"{'metric':24}  {'runs':>5}  {'p50':>10}  {'p95':>10}  {'unit':7}  {'config':16}  suite")
+    for (benchmark, metric, unit, name, digest), values in sorted(groups.items()):
+        values.sort()
+        print(f"{benchmark + '.' + metric:24}  {len(values):>5}  {percentile(values, 50):>10.2f}  "
+              f"{percentile(values, 95):>10.2f}  {unit:7}  {digest:16}  {name}")
+
+
+def show_regressions(conn, limit=20):
+    print(f"{'id':>6}  {'started':19}  {'boot':>6}  {'baseline':>8}  {'config':16}  suite")
+    for run_id, name, digest, started, boot, baseline in conn.execute(
+            "SELECT id, suite, config_digest, started_at, boot_time, baseline FROM runs "
+            "WHERE regression = 1 ORDER BY started_at DESC LIMIT ?", (limit,)):
+        started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(started))
+        print(f"{run_id:>6}  {started}  {_fmt(boot):>6}  {_fmt(baseline):>8}  {digest:16}  {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="VirtualPilot run history")
+    parser.add_argument("--db", default=HISTORY_DB, help=f"History database (default: {HISTORY_DB})")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    runs = sub.add_parser("runs", help="List recent runs with per-step durations")
+    runs.add_argument("--suite", help="Only runs of this suite yaml")
+    runs.add_argument("--limit", type=int, default=20)
+
+    trends = sub.add_parser("trends", help="Pass rate and p50/p95 boot time per config")
+    trends.add_argument("--suite", help="Only configs of this suite yaml")
+
+    metrics = sub.add_parser("metrics", help="p50/p95 of benchmark metrics per config")
+    metrics.add_argument("--suite", help="Only configs of this suite yaml")
+    metrics.add_argument("--by", help="Group by these comma separated suite params, "
+                                      "e.g. accelerator,disk_bus,disk_cache,disk_io")
+
+    regressions = sub.add_parser("regressions", help="Runs flagged as boot time regressions")
+    regressions.add_argument("--limit", type=int, default=20)
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f"No run history found at {args.db}")
+        return
+
+    conn = connect(args.db)
+    try:
+        if args.command == "runs":
+            show_runs(conn, args.suite, args.limit)
+        elif args.command == "trends":
+            show_trends(conn, args.suite)
+        elif args.command == "metrics":
+            show_metrics(conn, args.suite, args.by.split(",") if args.by else None)
+        elif args.command == "regressions":
+            show_regressions(conn, args.limit)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
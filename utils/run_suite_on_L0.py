@@ -1,8 +1,16 @@
-import subprocess
 import paramiko
+import json
 import os
+import re
+import shlex
+import tempfile
 import time
+import yaml
 from scp import SCPClient
+from orchestrator import nesting_depth, STEP_TIMING_MARKER
+from utils import checkpoint
+from utils import run_history
+from utils import guest_agent
 
 
 DEFAULTS = {
@@ -10,15 +18,38 @@ DEFAULTS = {
     'l0_username': 'root',
     'l0_password': '123456',
     'l0_location': '/home/VirtualPilot/',
+    'l0_ready_timeout': 120,
     'host_virtualpilot': 'virtualpilot.py',
     'host_orchestrator': 'orchestrator.py',
     'host_script': 'src/guest_bringup.py',
     'host_suite': 'config/suites/nested_kvm_pseries_bringup.yaml',
     'nested_guest_image': 'guests/qcows/small-fedora43.qcow2',
+    'host_utils': ['utils/checkpoint.py', 'utils/result_cache.py', 'utils/run_history.py',
+                   'utils/adaptive_timeouts.py', 'utils/log_archive.py',
+                   'utils/guest_probe.py', 'utils/guest_benchmark.py',
+                   'utils/telemetry.py', 'utils/placement.py',
+                   'utils/image_prep.py', 'utils/guest_agent.py',
+                   'utils/console_mux.py'],
     'scp_guest': True,
-    'cleanup': True
+    # l0_* overrides per level, first for L0, then for the guest inside it, ...
+    'nested_levels': [],
+    # Level of the guest this run targets, set by the level above
+    'nesting_level': 0,
+    'cleanup': True,
+    # Keep the L0 state of a failed run for --resume, unless cleanup_on_failure: true
+    'checkpoint': False,
+    'cleanup_on_failure': False,
+    'resume': False,
+    'no_cache': False,
+    'run_info': None,
+    'checkpoint_dir': checkpoint.CHECKPOINT_DIR
 }
 
+# Step timings of the levels below carry their level, L<n>.<step>
+LEVEL_STEP = re.compile(r"^(L\d+)\.(.+)$")
+# Address queries once the L0 guest agent answers, 0.5s, 1s, 2s apart
+L0_ADDRESS_ATTEMPTS = 4
+
 
 def create_ssh_client(server, user, password):
     client = paramiko.SSHClient()
@@ -29,41 +60,104 @@ def create_ssh_client(server, user, password):
 
 def get_l0_ip(cfg):
     """
-    Try to get IP address of l0_name via 'virsh domifaddr'.
+    Wait for the guest agent of l0_name to answer, then get its IP address
+    from the agent (guest-network-get-interfaces). A guest whose agent is up
+    normally has its address already, the query is retried only a few times
+    with backoff in case DHCP is still configuring the interface.
     """
     try:
         print(f"Getting IP address of L0 VM: {cfg['l0_name']}")
-        cmd = f"virsh domifaddr {cfg['l0_name']} --source agent"
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True, timeout=10)
-        if result.returncode != 0:
-            return False, f"Failed to run virsh domifaddr: {result.stderr.strip()}"
-
-        for line in result.stdout.splitlines():
-            if 'ipv4' in line:
-                parts = line.split()
-                for part in parts:
-                    if '/' in part:
-                        ip = part.split('/')[0]
-                        if ip.startswith("127."):
-                            continue
-                        print(f"Found L0 IP: {ip}")
-                        return True, ip
-        print("No IP address found in virsh domifaddr output")
-        return False, "No IP address found in virsh domifaddr output"
+        status, result = guest_agent.wait_ready(cfg['l0_name'], cfg['l0_ready_timeout'])
+        if not status:
+            return False, result
+
+        delay = guest_agent.CONNECT_INTERVAL
+        for attempt in range(L0_ADDRESS_ATTEMPTS):
+            if attempt:
+                time.sleep(delay)
+                delay *= 2
+            status, result = guest_agent.ipv4_addresses(cfg['l0_name'])
+            if status and result:
+                print(f"Found L0 IP: {result[0]}")
+                return True, result[0]
+
+        error = f"Failed to get L0 interfaces from guest agent: {result}" if not status \
+            else "No IPv4 address reported by the L0 guest agent"
+        print(error)
+        return False, error
 
     except Exception as e:
         print(f"Exception in get_l0_ip: {str(e)}")
         return False, f"Exception in get_l0_ip: {str(e)}"
 
 
+def level_suite(cfg):
+    """
+    Suite for the level below: one nesting level less, the l0_* params of the
+    next guest down, and host_* paths pointing at the copies staged in
+    l0_location, so deeper levels forward those instead of the host resending
+    them. Returns (nesting levels left below, suite yaml).
+    """
+    with open(cfg['host_suite']) as f:
+        suite = yaml.safe_load(f)
+    remaining = nesting_depth(suite) - 1
+    params = dict(suite.get('params') or {})
+    params.update({
+        'nesting_level': cfg['nesting_level'] + 1,
+        'nested_levels': cfg['nested_levels'][1:],
+        'host_virtualpilot': os.path.basename(cfg['host_virtualpilot']),
+        'host_orchestrator': os.path.basename(cfg['host_orchestrator']),
+        'host_script': os.path.basename(cfg['host_script']),
+        'host_suite': os.path.basename(cfg['host_suite']),
+        'host_utils': [os.path.join('utils', os.path.basename(util)) for util in level_utils(cfg, remaining)],
+        'nested_guest_image': os.path.basename(cfg['nested_guest_image']),
+    })
+    suite['nested'] = remaining if remaining > 1 else remaining == 1
+    suite['params'] = params
+    return remaining, yaml.safe_dump(suite, sort_keys=False)
+
+
+def level_utils(cfg, remaining):
+    """
+    Helpers to push, with this module itself when the level below nests further
+    """
+    utils = list(cfg['host_utils'])
+    this_module = os.path.abspath(__file__)
+    if remaining > 0 and os.path.basename(this_module) not in [os.path.basename(u) for u in utils]:
+        utils.append(this_module)
+    return utils
+
+
+def staged_files(ssh, paths):
+    """
+    (size, mtime) of the files already in l0_location, scp keeps the mtime
+    of the source so unchanged artifacts aren't sent again
+    """
+    stdin, stdout, stderr = ssh.exec_command("stat -c '%s %Y %n' " + " ".join(shlex.quote(p) for p in paths) + " 2>/dev/null")
+    staged = {}
+    for line in stdout.read().decode().splitlines():
+        size, mtime, path = line.split(" ", 2)
+        staged[path] = (int(size), int(mtime))
+    return staged
+
+
 def scp_to_l0(cfg, ip_addr):
     """
-    SCP necessary files to l0_guest VM under l0_location
+    SCP necessary files to l0_guest VM under l0_location. The suite is
+    rewritten for the level below (see level_suite), files staged there by an
+    earlier run with the same size and mtime are kept.
     """
+    suite_copy = None
     try:
+        remaining, suite_text = level_suite(cfg)
+        with tempfile.NamedTemporaryFile("w", suffix=".yaml", delete=False) as f:
+            f.write(suite_text)
+            suite_copy = f.name
+        print(f"Suite for level L{cfg['nesting_level']}: nested {remaining} level(s) further")
+
         ssh = create_ssh_client(ip_addr, cfg['l0_username'], cfg['l0_password'])
         # Create dir on remote if not exists
-        stdin, stdout, stderr = ssh.exec_command(f"mkdir -p {cfg['l0_location']}")
+        stdin, stdout, stderr = ssh.exec_command(f"mkdir -p {shlex.quote(os.path.join(cfg['l0_location'], 'utils'))}")
         exit_status = stdout.channel.recv_exit_status()
         if exit_status != 0:
             return False, f"Failed to create directory {cfg['l0_location']}: {stderr.read().decode()}"
@@ -73,30 +167,71 @@ def scp_to_l0(cfg, ip_addr):
             (cfg['host_virtualpilot'], os.path.join(cfg['l0_location'], os.path.basename(cfg['host_virtualpilot']))),
             (cfg['host_orchestrator'], os.path.join(cfg['l0_location'], os.path.basename(cfg['host_orchestrator']))),
             (cfg['host_script'], os.path.join(cfg['l0_location'], os.path.basename(cfg['host_script']))),
-            (cfg['host_suite'], os.path.join(cfg['l0_location'], os.path.basename(cfg['host_suite'])))
         ]
+        # Helper modules imported by the scripts keep their utils/ location
+        for util in level_utils(cfg, remaining):
+            files_to_copy.append((util, os.path.join(cfg['l0_location'], 'utils', os.path.basename(util))))
         if cfg.get('scp_guest', True):
             files_to_copy.append(
                 (cfg['nested_guest_image'], os.path.join(cfg['l0_location'], os.path.basename(cfg['nested_guest_image'])))
             )
 
+        staged = staged_files(ssh, [dest for _, dest in files_to_copy])
         scp = SCPClient(ssh.get_transport())
         for src, dest in files_to_copy:
             if not os.path.exists(src):
                 return False, f"Source file not found: {src}"
-            print(f"SCPing to L0: {src} to {dest} on L0")
-            scp.put(src, dest)
+            src_stat = os.stat(src)
+            if staged.get(dest) == (src_stat.st_size, int(src_stat.st_mtime)):
+                print(f"Already staged on L{cfg['nesting_level']}: {dest}")
+                continue
+            print(f"SCPing to L{cfg['nesting_level']}: {src} to {dest}")
+            scp.put(src, dest, preserve_times=True)
+        scp.put(suite_copy, os.path.join(cfg['l0_location'], os.path.basename(cfg['host_suite'])))
         scp.close()
         ssh.close()
         return True, None
 
     except Exception as e:
         return False, f"SCP to L0 failed: {str(e)}"
+    finally:
+        if suite_copy is not None and os.path.exists(suite_copy):
+            os.remove(suite_copy)
+
+
+def merge_level_steps(cfg, output):
+    """
+    Add the step timings printed by the run on the level below to run_info,
+    as L<level>.<step>. Steps of deeper levels already carry their level.
+    """
+    if cfg['run_info'] is None:
+        return
+    timings = [line for line in output.splitlines() if line.startswith(STEP_TIMING_MARKER)]
+    if not timings:
+        return
+    for name, seconds in json.loads(timings[-1][len(STEP_TIMING_MARKER):]).items():
+        if not LEVEL_STEP.match(name):
+            name = f"L{cfg['nesting_level']}.{name}"
+        cfg['run_info']['steps'][name] = seconds
+
+
+def report_level_timing(run_info):
+    """
+    Print the step timings of each level, host first
+    """
+    levels = {}
+    for name, seconds in run_info['steps'].items():
+        match = LEVEL_STEP.match(name)
+        level, step = match.groups() if match else ("host", name)
+        levels.setdefault(level, {})[step] = seconds
+
+    for level in sorted(levels, key=lambda l: -1 if l == "host" else int(l[1:])):
+        print(f"Nested timing | {level}: " + ", ".join(f"{step} {seconds:.2f}s" for step, seconds in levels[level].items()))
 
 
 def ssh_and_run(cfg, ip_addr):
     """
-    SSH to L0 and run virtualpilot.py with suite argument
+    SSH to L0 and run virtualpilot.py with the suite written by level_suite
     """
     try:
         ssh = create_ssh_client(ip_addr, cfg['l0_username'], cfg['l0_password'])
@@ -104,22 +239,14 @@ def ssh_and_run(cfg, ip_addr):
         virtualpilot_path = os.path.join(cfg['l0_location'], os.path.basename(cfg['host_virtualpilot']))
         suite_path = os.path.join(cfg['l0_location'], os.path.basename(cfg['host_suite']))
 
-        edit_nested_param = f"sed -i 's/nested: true/nested: false/' {suite_path}"
-        run_virtualpilot = f"cd {virtualpilot_dir} && python3 {virtualpilot_path} --config {suite_path}"
-
-        # First, edit the suite to set nested: false
-        print(f"Editing suite file on L0 to set nested: false: {suite_path}")
-        stdin, stdout, stderr = ssh.exec_command(edit_nested_param)
-        out = stdout.read().decode()
-        err = stderr.read().decode()
-
-        exit_code = stdout.channel.recv_exit_status()
-        if exit_code != 0:
-            ssh.close()
-            return False, f"Failed to edit suite file on L0 with exit code {exit_code}, stderr: {err}"
+        run_virtualpilot = (f"cd {shlex.quote(virtualpilot_dir)} && "
+                            f"python3 {shlex.quote(virtualpilot_path)} --config {shlex.quote(suite_path)}")
+        if cfg['resume']:
+            run_virtualpilot += " --resume"
+        if cfg['no_cache']:
+            run_virtualpilot += " --no-cache"
 
-        # Now run virtualpilot
-        print(f"Running VirtualPilot on L0: {virtualpilot_path} with suite {suite_path}")
+        print(f"Running VirtualPilot on L{cfg['nesting_level']}: {virtualpilot_path} with suite {suite_path}")
         print(f"Command: {run_virtualpilot}")
         stdin, stdout, stderr = ssh.exec_command(run_virtualpilot)
         out = stdout.read().decode()
@@ -127,6 +254,7 @@ def ssh_and_run(cfg, ip_addr):
 
         exit_code = stdout.channel.recv_exit_status()
         ssh.close()
+        merge_level_steps(cfg, out)
 
         if exit_code != 0:
             return False, f"Command failed with exit code {exit_code}, stderr: {err}"
@@ -147,8 +275,8 @@ def copy_logs_back(cfg, ip_addr):
         # Assuming console logs have a fixed pattern or name
         # List files remote
         remote_dir = cfg['l0_location']
-        stdin, stdout, stderr = ssh.exec_command(f"ls {remote_dir}console_*.log")
-        files = stdout.read().decode().strip().split()
+        stdin, stdout, stderr = ssh.exec_command(f"ls {shlex.quote(remote_dir)}console_*.log")
+        files = stdout.read().decode().strip().splitlines()
         if not files:
             return False, "No console log files found on L0"
 
@@ -174,7 +302,7 @@ def cleanup_l0(cfg, ip_addr):
         return True, None
     try:
         ssh = create_ssh_client(ip_addr, cfg['l0_username'], cfg['l0_password'])
-        cmd = f"rm -rf {cfg['l0_location']}*"
+        cmd = f"rm -rf {shlex.quote(cfg['l0_location'])}*"
         stdin, stdout, stderr = ssh.exec_command(cmd)
         exit_status = stdout.channel.recv_exit_status()
         ssh.close()
@@ -186,6 +314,23 @@ def cleanup_l0(cfg, ip_addr):
         return False, f"Cleanup L0 failed: {str(e)}"
 
 
+def cleanup_after_failure(cfg, ip_addr, ckpt, error):
+    """
+    Cleanup L0 after a failed step, unless L0 state is kept for --resume
+    (checkpoint: true or a resumed run)
+    """
+    if (cfg['checkpoint'] or cfg['resume']) and not cfg['cleanup_on_failure']:
+        print(f"Cleanup: L0 state kept, checkpoint at {ckpt}, rerun with --resume to continue")
+        return error
+    print("Cleanup: Cleaning up L0 after failure")
+    checkpoint.clear_checkpoint(ckpt)
+    cleanup_status, cleanup_error = cleanup_l0(cfg, ip_addr)
+    if not cleanup_status:
+        print(f"Cleanup: Error during cleanup: {cleanup_error}")
+        error += f" | Cleanup error: {cleanup_error}"
+    return error
+
+
 def run_tool(config: dict):
     """
     run_script_on_L0.py
@@ -196,17 +341,33 @@ def run_tool(config: dict):
     5. Copy console logs back l0 to host
     6. if pass, return True, None
        else return False, "error message"
+
+    Steps 2-4 are checkpointed under checkpoint_dir, with resume: true
+    completed steps are skipped against the still staged L0 state. L0 is
+    cleaned up after a failure unless checkpoint: true or resuming.
+
+    With nested: <n> above 1 the suite pushed to L0 is itself nested, and
+    the run on L0 repeats these steps against the next guest down, from
+    the files staged on L0.
     """
     status = True
     error = None
 
     cfg = DEFAULTS.copy()
     cfg.update({k: v for k, v in config.items() if v is not None})
+    if cfg['nested_levels']:
+        cfg.update(cfg['nested_levels'][0])
+
+    suite_name = os.path.basename(cfg['host_suite'])
+    ckpt = checkpoint.checkpoint_path(f"run_suite_on_L0_{cfg['l0_name']}_{suite_name}", cfg['checkpoint_dir'])
+    if not cfg['resume']:
+        checkpoint.clear_checkpoint(ckpt)
 
     # Step 1: Get L0 IP
     print("\n*************** STEP 1 *****************")
     print("Step1: Get L0 IP address")
-    status, ip_addr = get_l0_ip(cfg)
+    with run_history.step(cfg['run_info'], "get_l0_ip"):
+        status, ip_addr = get_l0_ip(cfg)
     if not status:
         error = ip_addr
         print(f"Step1: Error getting L0 IP: {error}")
@@ -216,52 +377,53 @@ def run_tool(config: dict):
 
     # Step 2: SCP files to L0
     print("\n*************** STEP 2 *****************")
-    print("Step2: SCP files to L0")
-    status, error = scp_to_l0(cfg, ip_addr)
-    if not status:
-        print(f"Step2: Error SCP to L0: {error}")
-        print("Cleanup: Cleaning up L0 after SCP failure")
-        cleanup_status, cleanup_error = cleanup_l0(cfg, ip_addr)
-        if not cleanup_status:
-            print(f"Cleanup: Error during cleanup: {cleanup_error}")
-            error += f" | Cleanup error: {cleanup_error}"
-        return status, error
-    print("Step2: SCP to L0 completed successfully")
+    if checkpoint.step_done(ckpt, "artifacts_pushed"):
+        print("Step2: Resume: files already on L0, skipping SCP")
+    else:
+        print("Step2: SCP files to L0")
+        with run_history.step(cfg['run_info'], "scp_to_l0"):
+            status, error = scp_to_l0(cfg, ip_addr)
+        if not status:
+            print(f"Step2: Error SCP to L0: {error}")
+            return status, cleanup_after_failure(cfg, ip_addr, ckpt, error)
+        checkpoint.mark_step(ckpt, "artifacts_pushed")
+        print("Step2: SCP to L0 completed successfully")
 
     # Step 3: SSH and run
     print("\n*************** STEP 3 *****************")
-    print("Step3: SSH and run on L0")
-    status, error = ssh_and_run(cfg, ip_addr)
-    if not status:
-        print(f"Step3: Error SSH and run on L0: {error}")
-        print("Cleanup: Cleaning up L0 after ssh failure")
-        cleanup_status, cleanup_error = cleanup_l0(cfg, ip_addr)
-        if not cleanup_status:
-            print(f"Cleanup: Error during cleanup: {cleanup_error}")
-            error += f" | Cleanup error: {cleanup_error}"
-        return status, error
-    print("Step3: SSH and run on L0 completed successfully")
+    if checkpoint.step_done(ckpt, "remote_run_done"):
+        print("Step3: Resume: suite already ran on L0, skipping")
+    else:
+        print("Step3: SSH and run on L0")
+        with run_history.step(cfg['run_info'], "ssh_and_run"):
+            status, error = ssh_and_run(cfg, ip_addr)
+        if not status:
+            print(f"Step3: Error SSH and run on L0: {error}")
+            return status, cleanup_after_failure(cfg, ip_addr, ckpt, error)
+        checkpoint.mark_step(ckpt, "remote_run_done")
+        print("Step3: SSH and run on L0 completed successfully")
 
     # Step 4: Copy logs back
     print("\n*************** STEP 4 *****************")
     print("Step4: Copy logs back from L0")
-    status, error = copy_logs_back(cfg, ip_addr)
+    with run_history.step(cfg['run_info'], "copy_logs_back"):
+        status, error = copy_logs_back(cfg, ip_addr)
     if not status:
         print(f"Step4: Error copying logs back from L0: {error}")
-        print("Cleanup: Cleaning up L0 after SCP failure")
-        cleanup_status, cleanup_error = cleanup_l0(cfg, ip_addr)
-        if not cleanup_status:
-            print(f"Cleanup: Error during cleanup: {cleanup_error}")
-            error += f" | Cleanup error: {cleanup_error}"
-        return status, error
+        return status, cleanup_after_failure(cfg, ip_addr, ckpt, error)
+    checkpoint.mark_step(ckpt, "logs_pulled")
     print("Step4: Copy logs back from L0 completed successfully")
 
     # Step 5: Cleanup L0
     print("\n************* CLEAN UP *****************")
-    cleanup_status, cleanup_error = cleanup_l0(cfg, ip_addr)
+    with run_history.step(cfg['run_info'], "cleanup_l0"):
+        cleanup_status, cleanup_error = cleanup_l0(cfg, ip_addr)
     if not cleanup_status:
         print(f"Cleanup: Error during final cleanup: {cleanup_error}")
         error = cleanup_error
     print("Cleanup: Final Cleanup L0 completed successfully")
+    checkpoint.clear_checkpoint(ckpt)
 
+    if cfg['run_info'] is not None and cfg['nesting_level'] == 0:
+        report_level_timing(cfg['run_info'])
     return status, error
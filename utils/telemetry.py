@@ -0,0 +1,295 @@
+"""
+telemetry.py - background sampler of host and domain stats during a suite run
+
+Host CPU, memory, disk I/O and load are read from /proc. Domain stats
+(cpu/vcpu time, block and net counters, balloon) come from the libvirt
+python bindings when installed, else from 'virsh domstats' at a lower rate
+to keep the sampler cost under 1% CPU. Samples are written as gzipped
+JSON lines: {"t": seconds since start, "host": {...}, "domains": {name: {...}}}
+"""
+
+import gzip
+import json
+import os
+import subprocess
+import threading
+import time
+
+try:
+    import libvirt
+except ImportError:
+    libvirt = None
+
+
+TELEMETRY_DIR = "./results/telemetry"
+DEFAULT_INTERVAL = 2.0
+VIRSH_MIN_INTERVAL = 10.0
+DOMSTATS_ARGS = ["--cpu-total", "--vcpu", "--block", "--interface", "--balloon"]
+
+
+def read_cpu():
+    """
+    Aggregate jiffies from /proc/stat - (busy, iowait, total)
+    """
+    with open("/proc/stat") as f:
+        fields = [int(v) for v in f.readline().split()[1:]]
+    idle = fields[3] + fields[4]
+    return sum(fields) - idle, fields[4], sum(fields)
+
+
+def read_meminfo():
+    mem = {}
+    with open("/proc/meminfo") as f:
+        for line in f:
+            key, value = line.split(":", 1)
+            if key in ("MemTotal", "MemAvailable", "Dirty", "Writeback"):
+                mem[key] = int(value.split()[0])
+    return mem
+
+
+def read_diskstats():
+    """
+    Sectors read / written summed over whole disks, partitions excluded
+    """
+    read = written = 0
+    with open("/proc/diskstats") as f:
+        for line in f:
+            fields = line.split()
+            name = fields[2]
+            if not os.path.exists(f"/sys/block/{name}"):
+                continue
+            if name.startswith(("loop", "ram", "dm-")):
+                continue
+            read += int(fields[5])
+            written += int(fields[9])
+    return read, written
+
+
+def flatten_domstats(stats):
+    """
+    Reduce domstats keys (cpu.time, vcpu.N.time, block.N.rd.bytes, ...)
+    to per-domain totals
+    """
+    vcpu = sum(int(v) for k, v in stats.items() if k.startswith("vcpu.") and k.endswith(".time"))
+
+    def total(prefix, suffix):
+        return sum(int(v) for k, v in stats.items() if k.startswith(prefix) and k.endswith(suffix))
+
+    return {
+        "cpu_ns": int(stats.get("cpu.time", 0)),
+        "vcpu_ns": vcpu,
+        "blk_rd_bytes": total("block.", ".rd.bytes"),
+        "blk_wr_bytes": total("block.", ".wr.bytes"),
+        "net_rx_bytes": total("net.", ".rx.bytes"),
+        "net_tx_bytes": total("net.", ".tx.bytes"),
+        "balloon_kb": int(stats.get("balloon.current", 0)),
+        "balloon_rss_kb": int(stats.get("balloon.rss", 0)),
+    }
+
+
+def virsh_domstats(name, timeout=10):
+    """
+    Domain stats from virsh domstats, with the CPU seconds of that virsh
+    process alone (its own wait4 rusage, not the process-wide children
+    counters that other threads' children also land in).
+    Returns (stats or None, cpu seconds)
+    """
+    process = subprocess.Popen(["virsh", "domstats", *DOMSTATS_ARGS, name],
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    timer = threading.Timer(timeout, process.kill)
+    timer.start()
+    try:
+        output = process.stdout.read()
+        _, wait_status, usage = os.wait4(process.pid, 0)
+    finally:
+        timer.cancel()
+        process.stdout.close()
+    # Reaped above, keep Popen from waiting for it again
+    process.returncode = os.waitstatus_to_exitcode(wait_status)
+    cpu_seconds = usage.ru_utime + usage.ru_stime
+    if process.returncode != 0:
+        return None, cpu_seconds
+    stats = {}
+    for line in output.splitlines():
+        key, sep, value = line.strip().partition("=")
+        if sep:
+            stats[key] = value
+    return stats, cpu_seconds
+
+
+class Sampler(threading.Thread):
+    """
+    Samples host and domain stats every interval seconds until stop()
+    """
+
+    def __init__(self, path, domains, interval=DEFAULT_INTERVAL):
+        super().__init__(name="telemetry-sampler", daemon=True)
+        self.path = path
+        self.domains = [d for d in domains if d]
+        self.interval = interval
+        self.samples = 0
+        self.cpu_seconds = 0.0
+        self.elapsed = 0.0
+        self._stop_event = threading.Event()
+        self._conn = None
+        self._prev = {}
+
+        # virsh forks a process per call, sample domains less often without the bindings
+        self.domain_interval = interval if libvirt else max(interval, VIRSH_MIN_INTERVAL)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        return self.path
+
+    def cpu_percent(self):
+        """
+        CPU used by the sampler itself and the virsh calls it forks, as percent of one CPU
+        """
+        return 100.0 * self.cpu_seconds / self.elapsed if self.elapsed else 0.0
+
+    def _delta(self, key, value, now):
+        """
+        Change of a counter since its previous sample - (delta, seconds)
+        """
+        prev = self._prev.get(key)
+        self._prev[key] = (value, now)
+        if prev is None:
+            return None, None
+        return value - prev[0], now - prev[1]
+
+    def _rate(self, key, value, now):
+        delta, dt = self._delta(key, value, now)
+        if delta is None or dt <= 0:
+            return None
+        return delta / dt
+
+    def _domain_stats(self, name):
+        if libvirt:
+            try:
+                if self._conn is None:
+                    self._conn = libvirt.openReadOnly("qemu:///system")
+                dom = self._conn.lookupByName(name)
+                stats = self._conn.domainListGetStats(
+                    [dom],
+                    libvirt.VIR_DOMAIN_STATS_CPU_TOTAL | libvirt.VIR_DOMAIN_STATS_VCPU |
+                    libvirt.VIR_DOMAIN_STATS_BLOCK | libvirt.VIR_DOMAIN_STATS_INTERFACE |
+                    libvirt.VIR_DOMAIN_STATS_BALLOON
+                )
+                return stats[0][1] if stats else None
+            except libvirt.libvirtError:
+                return None
+        try:
+            stats, cpu_seconds = virsh_domstats(name)
+        except (OSError, subprocess.SubprocessError):
+            return None
+        self.cpu_seconds += cpu_seconds
+        return stats
+
+    def sample(self, now, with_domains):
+        busy, iowait, total = read_cpu()
+        d_busy, _ = self._delta("cpu_busy", busy, now)
+        d_iowait, _ = self._delta("cpu_iowait", iowait, now)
+        d_total, _ = self._delta("cpu_total", total, now)
+        mem = read_meminfo()
+        rd, wr = read_diskstats()
+        rd_rate = self._rate("disk_rd", rd, now)
+        wr_rate = self._rate("disk_wr", wr, now)
+
+        # diskstats counts 512 byte sectors
+        host = {
+            "cpu_pct": round(100.0 * d_busy / d_total, 1) if d_total else None,
+            "iowait_pct": round(100.0 * d_iowait / d_total, 1) if d_total else None,
+            "mem_avail_mb": mem.get("MemAvailable", 0) // 1024,
+            "mem_used_mb": (mem.get("MemTotal", 0) - mem.get("MemAvailable", 0)) // 1024,
+            "dirty_mb": (mem.get("Dirty", 0) + mem.get("Writeback", 0)) // 1024,
+            "disk_rd_kb_s": None if rd_rate is None else round(rd_rate / 2, 1),
+            "disk_wr_kb_s": None if wr_rate is None else round(wr_rate / 2, 1),
+            "load1": os.getloadavg()[0],
+        }
+
+        domains = {}
+        if with_domains:
+            for name in self.domains:
+                stats = self._domain_stats(name)
+                if not stats:
+                    continue
+                flat = flatten_domstats(stats)
+                dom = {"balloon_kb": flat["balloon_kb"], "balloon_rss_kb": flat["balloon_rss_kb"]}
+                # cpu/vcpu time in ns per second -> percent of one host CPU
+                for key in ("cpu_ns", "vcpu_ns"):
+                    rate = self._rate(f"{name}.{key}", flat[key], now)
+                    dom[key.replace("_ns", "_pct")] = None if rate is None else round(rate / 1e7, 1)
+                for key in ("blk_rd_bytes", "blk_wr_bytes", "net_rx_bytes", "net_tx_bytes"):
+                    rate = self._rate(f"{name}.{key}", flat[key], now)
+                    dom[key.replace("_bytes", "_kb_s")] = None if rate is None else round(rate / 1024, 1)
+                domains[name] = dom
+
+        return {"host": host, "domains": domains}
+
+    def run(self):
+        start = time.monotonic()
+        next_domains = start
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with gzip.open(self.path, "wt") as f:
+            while True:
+                cpu_start = time.thread_time()
+                now = time.monotonic()
+                with_domains = now >= next_domains
+                if with_domains:
+                    next_domains = now + self.domain_interval
+                try:
+                    sample = self.sample(now, with_domains)
+                    f.write(json.dumps({"t": round(now - start, 2), **sample}) + "\n")
+                    self.samples += 1
+                except (OSError, ValueError) as e:
+                    print(f"Telemetry | sample failed: {e}")
+                self.cpu_seconds += time.thread_time() - cpu_start
+                self.elapsed = time.monotonic() - start
+                if self._stop_event.wait(self.interval):
+                    break
+        if self._conn is not None:
+            self._conn.close()
+
+
+def start(path, domains, interval=DEFAULT_INTERVAL):
+    """
+    Start a sampler for the lifetime of a run_tool() call
+    """
+    sampler = Sampler(path, domains, interval)
+    sampler.start()
+    print(f"Telemetry | sampling every {interval}s to {path}")
+    return sampler
+
+
+def stop(sampler):
+    sampler.stop()
+    print(f"Telemetry | {sampler.samples} samples in {sampler.path}, "
+          f"sampler cpu {sampler.cpu_percent():.2f}%")
+    return sampler.path
+
+
+def show(path):
+    """
+    Print a telemetry file as a table
+    """
+    with gzip.open(path, "rt") as f:
+        print(f"{'t':>8}  {'cpu%':>5}  {'iow%':>5}  {'load':>5}  {'memMB':>7}  {'rdKB/s':>8}  {'wrKB/s':>8}  domains")
+        for line in f:
+            s = json.loads(line)
+            h = s["host"]
+            doms = "  ".join(
+                f"{n}: vcpu {d.get('vcpu_pct')}% blk {d.get('blk_rd_kb_s')}/{d.get('blk_wr_kb_s')}KB/s "
+                f"net {d.get('net_rx_kb_s')}/{d.get('net_tx_kb_s')}KB/s balloon {d.get('balloon_kb')}KB"
+                for n, d in s["domains"].items()
+            )
+            print(f"{s['t']:>8}  {str(h['cpu_pct']):>5}  {str(h['iowait_pct']):>5}  {h['load1']:>5.2f}  "
+                  f"{h['mem_used_mb']:>7}  {str(h['disk_rd_kb_s']):>8}  {str(h['disk_wr_kb_s']):>8}  {doms}")
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) != 2:
+        print("Usage: python3 utils/telemetry.py <telemetry_*.jsonl.gz>")
+        sys.exit(1)
+    show(sys.argv[1])
@@ -7,9 +7,17 @@ import yaml
 import os
 import sys
 import subprocess
+import time
+from utils import checkpoint
+from utils import result_cache
 
 
-def generate_avocado_suite_file(suite_config_path, output_file="avocado_main.py"):
+def suites_checkpoint_path(suite_config_path):
+    """Checkpoint file tracking completed suites of a multi-suite run."""
+    return checkpoint.checkpoint_path(f"avocado_{os.path.basename(suite_config_path)}")
+
+
+def generate_avocado_suite_file(suite_config_path, output_file="avocado_main.py", resume=False, use_cache=True):
     """Generate the Avocado suite file with hardcoded suite methods."""
 
     # Load the suite configuration
@@ -26,6 +34,7 @@ def generate_avocado_suite_file(suite_config_path, output_file="avocado_main.py"
         sys.exit(1)
 
     print(f"Generating Avocado suite file with {len(suites_to_run)} suites...")
+    uncached = result_cache.guests_needed_later(suites_to_run) if use_cache else set()
 
     # Generate the suite file content
     suite_file_content = '''"""
@@ -36,9 +45,14 @@ DO NOT EDIT - Generated by virtual-pilot.py
 import yaml
 from avocado import Test
 from orchestrator import run_suite_from_config
+from utils import checkpoint
 
+CHECKPOINT = "{suites_checkpoint}"
+RESUME = {resume}
+USE_CACHE = {use_cache}
 
-'''
+
+'''.format(suites_checkpoint=suites_checkpoint_path(suite_config_path), resume=resume, use_cache=use_cache)
 
     # Generate a suite class for each YAML file
     for idx, suite_yaml in enumerate(suites_to_run, 1):
@@ -51,11 +65,15 @@ class {class_name}(Test):
 
     def test_suite(self):
         suite_yaml = "{suite_yaml}"
+        if RESUME and checkpoint.step_done(CHECKPOINT, suite_yaml):
+            print(f"Resume: suite {{suite_yaml}} already passed, skipping")
+            return
         print(f"=========== Running suite: {{suite_yaml}} ===========")
-        result, error = run_suite_from_config(suite_yaml)
+        result, error = run_suite_from_config(suite_yaml, resume=RESUME, use_cache={"False" if suite_yaml in uncached else "USE_CACHE"})
         print(f"Suite Name: {{suite_yaml}}")
 
         if result:
+            checkpoint.mark_step(CHECKPOINT, suite_yaml)
             print(f"Status: PASS")
             print(f"Error: NA")
         else:
@@ -125,6 +143,18 @@ Examples:
         help='Only list suites without running them'
     )
 
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Skip suites that passed in the previous run and resume the failed one'
+    )
+
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Run every suite even if an identical run passed recently'
+    )
+
     parser.add_argument(
         '--keep-generated',
         action='store_true',
@@ -138,8 +168,14 @@ Examples:
         print(f"ERROR: Config file not found: {args.config}")
         sys.exit(1)
 
+    # Fresh runs forget which suites passed previously
+    suites_checkpoint = suites_checkpoint_path(args.config)
+    if not args.resume and not args.list_only:
+        checkpoint.clear_checkpoint(suites_checkpoint)
+
     # Generate the suite file
-    suite_file, num_suites = generate_avocado_suite_file(args.config, args.output_file)
+    suite_file, num_suites = generate_avocado_suite_file(
+        args.config, args.output_file, args.resume, not args.no_cache)
 
     try:
         if args.list_only:
@@ -149,7 +185,13 @@ Examples:
             return_code = 0
         else:
             # Run the suites
+            start = time.time()
             return_code = run_avocado_suites(suite_file, args.results_dir)
+            cached, saved = result_cache.saved_since(start)
+            if cached:
+                print(f"\nResult cache: {cached} suite(s) cached-pass, saved {saved:.1f}s of wall time")
+            if return_code == 0:
+                checkpoint.clear_checkpoint(suites_checkpoint)
     finally:
         # Clean up generated file unless --keep-generated is specified
         if not args.keep_generated and os.path.exists(suite_file):
@@ -0,0 +1,216 @@
+"""
+virtual-pilot-coordinator.py - dispatch suites_to_run to queue workers
+
+Each suite goes to the best-fit live worker (virtual-pilot-worker.py) for
+its accelerator, memory, vCPUs and guest image. Suites acting on the same
+guest (bringup, then bringdown) keep their order and go to the worker that
+runs that guest, nested suites keep their order with the suites of their L0
+domain. Independent suites run in parallel across workers. Job
+events and results are streamed back as workers report them.
+
+python3 virtual-pilot-coordinator.py --config config/avocado-suites/guest_sanity.yaml [--queue ./results/queue] [--follow]
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+import yaml
+from utils import job_queue
+from utils import result_cache
+
+
+class Coordinator:
+    def __init__(self, queue, jobs, dispatch_timeout, follow):
+        self.queue = queue
+        self.jobs = jobs
+        self.pending = list(jobs)
+        self.outstanding = {}
+        self.results = {}
+        self.affinity = {}
+        self.dispatch_timeout = dispatch_timeout
+        self.follow = follow
+        self.event_offsets = {}
+        self.log_offsets = {}
+        self.waiting_since = {}
+
+    def finish(self, job, result):
+        self.results[job["id"]] = result
+        self.outstanding.pop(job["id"], None)
+        error = f" - {result['error']}" if result.get("error") else ""
+        print(f"Coordinator | {job['suite']}: {result['status'].upper()} on {result.get('worker')} "
+              f"in {result.get('duration', 0)}s{error}")
+
+    def guest_busy(self, job):
+        """
+        Whether an earlier job on the same guest or L0 domain hasn't finished
+        """
+        domains = job_queue.job_domains(job["requirements"])
+        if not domains:
+            return False
+        for other in self.jobs:
+            if other is job:
+                return False
+            if domains & job_queue.job_domains(other["requirements"]) and other["id"] not in self.results:
+                return True
+        return False
+
+    def dispatch(self, workers):
+        # Resources of dispatched guests the worker hasn't reserved in its advertisement yet
+        queued = {}
+        busy = {}
+        for job_id, worker_id in self.outstanding.items():
+            busy[worker_id] = busy.get(worker_id, 0) + 1
+            req = self.job(job_id)["requirements"]
+            if worker_id in workers and req["guest"] not in workers[worker_id]["reserved"]:
+                queued.setdefault(worker_id, []).append(req)
+
+        for job in list(self.pending):
+            if self.guest_busy(job):
+                continue
+            req = job["requirements"]
+            pinned = self.affinity.get(req["guest"]) if req["guest"] else None
+            if pinned:
+                if pinned not in workers:
+                    self.pending.remove(job)
+                    self.finish(job, {"status": "fail", "worker": pinned,
+                                      "error": f"worker {pinned} running guest {req['guest']} is gone"})
+                    continue
+                fit = job_queue.fits(workers[pinned], req, queued.get(pinned, []), busy.get(pinned, 0))
+                worker_id = pinned if fit else None
+            else:
+                worker_id = job_queue.best_fit(workers, req, queued, busy)
+
+            if worker_id is None:
+                waited = time.monotonic() - self.waiting_since.setdefault(job["id"], time.monotonic())
+                if waited > self.dispatch_timeout:
+                    self.pending.remove(job)
+                    self.finish(job, {"status": "fail", "worker": None,
+                                      "error": f"no worker fits {req} after {self.dispatch_timeout}s"})
+                continue
+
+            job_queue.write_json(job_queue.queue_path(self.queue, "inbox", worker_id, f"{job['id']}.json"), job)
+            self.pending.remove(job)
+            self.outstanding[job["id"]] = worker_id
+            queued.setdefault(worker_id, []).append(req)
+            busy[worker_id] = busy.get(worker_id, 0) + 1
+            if req["guest"]:
+                self.affinity[req["guest"]] = worker_id
+            print(f"Coordinator | {job['suite']} -> {worker_id}")
+
+    def job(self, job_id):
+        return next(j for j in self.jobs if j["id"] == job_id)
+
+    def collect(self, workers):
+        for job_id, worker_id in list(self.outstanding.items()):
+            job = self.job(job_id)
+            events, self.event_offsets[job_id] = job_queue.read_events(self.queue, job_id, self.event_offsets.get(job_id, 0))
+            for event in events:
+                if event["event"] == "started":
+                    print(f"Coordinator | {job['suite']} started on {event['worker']} ({event['host']})")
+                elif event["event"] == "finished":
+                    self.finish(job, event)
+            if self.follow:
+                self.stream_log(job)
+            if job_id in self.results or worker_id in workers:
+                continue
+
+            # Worker gone: take back jobs it didn't claim, fail the one it was running
+            try:
+                os.remove(os.path.join(self.queue, "inbox", worker_id, f"{job_id}.json"))
+                print(f"Coordinator | {worker_id} is gone, requeueing {job['suite']}")
+                del self.outstanding[job_id]
+                if job["requirements"]["guest"] and self.affinity.get(job["requirements"]["guest"]) == worker_id:
+                    del self.affinity[job["requirements"]["guest"]]
+                self.pending.insert(0, job)
+            except FileNotFoundError:
+                self.finish(job, {"status": "fail", "worker": worker_id,
+                                  "error": f"worker {worker_id} lost while running the suite"})
+
+    def stream_log(self, job):
+        path = os.path.join(self.queue, "logs", f"{job['id']}.log")
+        if not os.path.exists(path):
+            return
+        with open(path, "rb") as f:
+            f.seek(self.log_offsets.get(job["id"], 0))
+            data = f.read()
+        # Only complete lines, the rest is printed on the next poll
+        complete = data[:data.rfind(b"\n") + 1]
+        self.log_offsets[job["id"]] = self.log_offsets.get(job["id"], 0) + len(complete)
+        for line in complete.decode("utf-8", "replace").splitlines():
+            print(f"[{os.path.basename(job['suite'])}] {line}")
+
+    def run(self):
+        announced = False
+        while self.pending or self.outstanding:
+            workers = job_queue.list_workers(self.queue)
+            if not workers and not announced:
+                print(f"Coordinator | waiting for workers on {os.path.abspath(self.queue)}")
+                announced = True
+            self.dispatch(workers)
+            self.collect(workers)
+            time.sleep(job_queue.POLL_INTERVAL)
+        return all(r["status"] == "pass" for r in self.results.values())
+
+
+def load_jobs(config, queue, resume, use_cache):
+    with open(config) as f:
+        suites_to_run = yaml.safe_load(f).get("suites_to_run", [])
+    run_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+    uncached = result_cache.guests_needed_later(suites_to_run) if use_cache else set()
+    jobs = []
+    for idx, suite in enumerate(suites_to_run):
+        with open(suite) as f:
+            text = f.read()
+        job_id = f"{run_id}-{idx:03d}-{os.path.splitext(os.path.basename(suite))[0]}"
+        with open(job_queue.queue_path(queue, "specs", f"{job_id}.yaml"), "w") as f:
+            f.write(text)
+        jobs.append({
+            "id": job_id,
+            "suite": suite,
+            "requirements": job_queue.suite_requirements(yaml.safe_load(text)),
+            "resume": resume,
+            "use_cache": use_cache and suite not in uncached,
+            "submitted_at": time.time(),
+        })
+    return run_id, jobs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="VirtualPilot coordinator - run suites_to_run on queue workers")
+    parser.add_argument("--config", required=True, help="Suite YAML listing suites_to_run")
+    parser.add_argument("--queue", default=job_queue.QUEUE_DIR, help=f"Queue directory (default: {job_queue.QUEUE_DIR})")
+    parser.add_argument("--dispatch-timeout", type=int, default=600,
+                        help="Fail a suite no worker can take within this many seconds (default: 600)")
+    parser.add_argument("--follow", action="store_true", help="Stream suite output from the workers")
+    parser.add_argument("--resume", action="store_true", help="Pass --resume to every suite")
+    parser.add_argument("--no-cache", action="store_true", help="Pass --no-cache to every suite")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.config):
+        print(f"ERROR: Config file not found: {args.config}")
+        sys.exit(1)
+
+    run_id, jobs = load_jobs(args.config, args.queue, args.resume, not args.no_cache)
+    if not jobs:
+        print("ERROR: No suites specified in suite configuration")
+        sys.exit(1)
+    print(f"Coordinator | run {run_id}: {len(jobs)} suites")
+
+    start = time.monotonic()
+    coordinator = Coordinator(args.queue, jobs, args.dispatch_timeout, args.follow)
+    passed = coordinator.run()
+
+    summary = [coordinator.results[job["id"]] | {"suite": job["suite"]} for job in jobs]
+    job_queue.write_json(job_queue.queue_path(args.queue, "runs", f"{run_id}.json"), summary)
+    print(f"\nCoordinator | {sum(r['status'] == 'pass' for r in summary)}/{len(summary)} suites passed "
+          f"in {time.monotonic() - start:.1f}s")
+    for result in summary:
+        print(f"  {result['status'].upper():<4}  {result['suite']}  ({result.get('worker')})")
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+virtual-pilot-worker.py - worker daemon running suites from the job queue
+
+Advertises the capacity of this host (accelerators, memory and vCPUs not
+reserved by its guests, cached guest images, defined domains) in the queue,
+claims the jobs the coordinator dispatches to it and runs each with
+virtual-pilot.py, streaming events and output back through the queue.
+
+python3 virtual-pilot-worker.py [--queue ./results/queue] [--id <worker>] [--slots 1]
+python3 virtual-pilot-worker.py --id w1 --memory-mb 16384 --vcpus 8 --accelerators tcg   # capacity overrides, for local testing
+"""
+
+import argparse
+import glob
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from utils import job_queue
+
+
+class Worker:
+    def __init__(self, queue, worker_id, slots, overrides):
+        self.queue = queue
+        self.id = worker_id
+        self.slots = slots
+        self.overrides = overrides
+        self.running = {}
+        # guest -> (memory_mb, vcpus) of guests brought up here and not yet brought down
+        self.reserved = {}
+        self.lock = threading.Lock()
+        self.stopping = False
+        # Set by the signal handler only, acted on by serve()
+        self.signals = 0
+        self.advert_path = job_queue.queue_path(queue, "workers", f"{worker_id}.json")
+        self.inbox = os.path.dirname(job_queue.queue_path(queue, "inbox", worker_id, "x"))
+        self.running_dir = os.path.dirname(job_queue.queue_path(queue, "running", worker_id, "x"))
+
+    def advertise(self):
+        with self.lock:
+            reserved_mb = sum(mb for mb, _ in self.reserved.values())
+            reserved_vcpus = sum(v for _, v in self.reserved.values())
+            running = list(self.running)
+            reserved = list(self.reserved)
+        capacity = job_queue.host_capacity(reserved_mb, reserved_vcpus, self.overrides)
+        capacity.update({
+            "id": self.id,
+            "pid": os.getpid(),
+            "slots": self.slots,
+            "running": running,
+            "reserved": reserved,
+            "accepting": not self.stopping,
+            "heartbeat": time.time(),
+        })
+        job_queue.write_json(self.advert_path, capacity)
+
+    def claim(self):
+        """
+        Claim dispatched jobs, oldest first, while slots are free
+        """
+        for path in sorted(glob.glob(os.path.join(self.inbox, "*.json")), key=os.path.getmtime):
+            if self.stopping or len(self.running) >= self.slots:
+                return
+            claimed = os.path.join(self.running_dir, os.path.basename(path))
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                # Taken back by the coordinator
+                continue
+            job = job_queue.read_json(claimed)
+            job_queue.append_event(self.queue, job["id"], "claimed", worker=self.id)
+            thread = threading.Thread(target=self.run_job, args=(job, claimed), daemon=True)
+            with self.lock:
+                self.running[job["id"]] = thread
+                req = job["requirements"]
+                if req["bringup"] and req["guest"]:
+                    self.reserved[req["guest"]] = (req["memory_mb"], req["vcpus"])
+            thread.start()
+            self.advertise()
+
+    def run_job(self, job, claimed):
+        req = job["requirements"]
+        cmd = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "virtual-pilot.py"),
+               "--config", os.path.join(self.queue, "specs", f"{job['id']}.yaml")]
+        if job.get("resume"):
+            cmd.append("--resume")
+        if not job.get("use_cache", True):
+            cmd.append("--no-cache")
+
+        print(f"Worker {self.id} | running {job['suite']} ({job['id']})")
+        job_queue.append_event(self.queue, job["id"], "started", worker=self.id, host=socket.gethostname())
+        log_path = job_queue.queue_path(self.queue, "logs", f"{job['id']}.log")
+        start = time.monotonic()
+        error = None
+        with open(log_path, "w") as log:
+            process = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT, env=dict(os.environ, PYTHONUNBUFFERED="1"))
+            returncode = process.wait()
+        duration = time.monotonic() - start
+
+        if returncode != 0:
+            with open(log_path) as f:
+                failures = re.findall(r"^Failure: (.*)$", f.read(), re.MULTILINE)
+            error = failures[-1] if failures else f"virtual-pilot.py exited with {returncode}"
+
+        result = {
+            "id": job["id"],
+            "suite": job["suite"],
+            "worker": self.id,
+            "status": "pass" if returncode == 0 else "fail",
+            "error": error,
+            "duration": round(duration, 2),
+            "log": log_path,
+        }
+        job_queue.write_json(job_queue.queue_path(self.queue, "results", f"{job['id']}.json"), result)
+        job_queue.append_event(self.queue, job["id"], "finished", **result)
+        print(f"Worker {self.id} | {job['suite']}: {result['status']} in {duration:.1f}s")
+
+        with self.lock:
+            del self.running[job["id"]]
+            # Guests of failed bringups are still destroyed by their bringdown
+            if req["bringdown"]:
+                self.reserved.pop(req["guest"], None)
+        os.remove(claimed)
+        self.advertise()
+
+    def serve(self):
+        print(f"Worker {self.id} | serving queue {os.path.abspath(self.queue)} with {self.slots} slot(s)")
+        last_advert = 0
+        while not (self.stopping and not self.running):
+            if self.signals > 1:
+                print(f"Worker {self.id} | stopping now, running jobs are abandoned")
+                os.remove(self.advert_path)
+                os._exit(1)
+            if self.signals and not self.stopping:
+                print(f"Worker {self.id} | stopping after {len(self.running)} running job(s), signal again to stop now")
+                self.stopping = True
+                last_advert = 0
+            if time.monotonic() - last_advert >= job_queue.HEARTBEAT_INTERVAL:
+                self.advertise()
+                last_advert = time.monotonic()
+            self.claim()
+            time.sleep(job_queue.POLL_INTERVAL)
+        os.remove(self.advert_path)
+        print(f"Worker {self.id} | stopped")
+
+    def stop(self, signum, frame):
+        # The main thread may hold self.lock, serve() stops and re-advertises
+        self.signals += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="VirtualPilot worker - run suites from the job queue")
+    parser.add_argument("--queue", default=job_queue.QUEUE_DIR, help=f"Queue directory (default: {job_queue.QUEUE_DIR})")
+    parser.add_argument("--id", default=f"{socket.gethostname()}-{os.getpid()}", help="Worker id (default: <host>-<pid>)")
+    parser.add_argument("--slots", type=int, default=1, help="Suites run at the same time (default: 1)")
+    parser.add_argument("--memory-mb", type=int, help="Advertise this much memory instead of MemTotal")
+    parser.add_argument("--vcpus", type=int, help="Advertise this many vCPUs instead of the host CPUs")
+    parser.add_argument("--accelerators", help="Advertise these accelerators, e.g. kvm,tcg")
+    args = parser.parse_args()
+
+    overrides = {}
+    if args.memory_mb is not None:
+        overrides["memory_mb"] = args.memory_mb
+    if args.vcpus is not None:
+        overrides["vcpus"] = args.vcpus
+    if args.accelerators:
+        overrides["accelerators"] = args.accelerators.split(",")
+
+    worker = Worker(args.queue, args.id, args.slots, overrides)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    worker.serve()
+
+
+if __name__ == "__main__":
+    main()
@@ -11,9 +11,19 @@ def main():
         default="config/suites/kvm_pseries_bringup.yaml",
         help="Path to YAML file listing which tests to run"
     )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue from the first incomplete step of a previous run"
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Run the suite even if an identical run passed recently"
+    )
     args = parser.parse_args()
 
-    result, error = run_suite_from_config(args.config)
+    result, error = run_suite_from_config(args.config, resume=args.resume, use_cache=not args.no_cache)
     if not result:
         print(f"\nVirtualPilot Suite Failed: {args.config}\nFailure: {error}")
         sys.exit(error)